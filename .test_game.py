@@ -0,0 +1,132 @@
+#!/usr/bin/python
+
+# This tests game generation with variations of Game.conf,
+# for every way of generating the dungeon.
+
+import os
+import sys
+import random
+import tempfile
+import ConfigParser
+import CONSTANTS
+import Utilities
+import Game
+
+red = "\033[1;31m"
+green = "\033[1;32m"
+yellow = "\033[1;33m"
+reset = "\033[1;m"
+has_errors = False
+
+#values of CONSTANTS.PREGENERATE_LEVELS to test, levels are generated when
+#they are needed or the next one is built in advance
+GENERATION_MODES = (False, True)
+
+
+def copy_config(config):
+    """
+    Returns a copy of a config parser that can be changed.
+    """
+    copy = ConfigParser.ConfigParser()
+    for section in config.sections():
+        copy.add_section(section)
+        for key, value in config.items(section):
+            copy.set(section, key, value)
+    return copy
+
+
+def generate_games(config, seed):
+    """
+    Generates a game with a complete dungeon for every generation mode,
+    using the given config instead of Game.conf.
+    """
+    handle, path = tempfile.mkstemp(suffix='.conf')
+    original = (CONSTANTS.MONSTER_CONFIG, CONSTANTS.PREGENERATE_LEVELS)
+    games = []
+    try:
+        with os.fdopen(handle, 'w') as config_file:
+            config.write(config_file)
+        CONSTANTS.MONSTER_CONFIG = path
+        for pregenerate in GENERATION_MODES:
+            CONSTANTS.PREGENERATE_LEVELS = pregenerate
+            game = Game.Game(None, seed)
+            game.generateDungeon()
+            games.append(game)
+    finally:
+        CONSTANTS.MONSTER_CONFIG, CONSTANTS.PREGENERATE_LEVELS = original
+        os.remove(path)
+    return games
+
+
+def dungeon_is_complete(game):
+    """
+    Test that all dungeon levels have been generated.
+    """
+    global has_errors
+    #the town and the dungeon levels
+    if len(game.levels) != CONSTANTS.DUNGEON_DEPTH + 1:
+        has_errors = True
+        print(yellow + '\t\tonly ' + str(len(game.levels)) +
+                ' levels generated' + reset)
+
+
+def created_at_most_once(game, monster_name):
+    """
+    Test that the monster occurs at most once in the game.
+    """
+    global has_errors
+    count = 0
+    for level in game.levels:
+        for character in level.characters:
+            if character.id == monster_name:
+                count += 1
+    if count > 1:
+        has_errors = True
+        print(yellow + '\t\t"' + monster_name + '" created ' +
+                str(count) + ' times' + reset)
+
+
+def unique_monsters(config, unique_names):
+    """
+    Test games in which the given monsters are unique.
+    """
+    global has_errors
+    unique_config = copy_config(config)
+    for monster_name in unique_names:
+        unique_config.set(monster_name, 'unique', 'True')
+    try:
+        games = generate_games(unique_config, 1)
+    except Exception, e:
+        has_errors = True
+        print(yellow + '\t\t' + e.__class__.__name__ + ': ' + str(e) + reset)
+        return
+    for game in games:
+        dungeon_is_complete(game)
+        for monster_name in unique_names:
+            created_at_most_once(game, monster_name)
+
+
+if __name__ == '__main__':
+    config = ConfigParser.ConfigParser()
+    try:
+        print('\nReading Game.conf')
+        config.read('Game.conf')
+    except Exception, e:
+        print(red + str(e) + reset)
+        sys.exit(1)
+    #run the game without an application to show messages
+    Utilities.application = None
+
+    monster_names = config.get('lists', 'monster list').split(', ')
+
+    print('Checking unique monsters')
+    print('* testing unique %s...' % monster_names[0])
+    unique_monsters(config, monster_names[:1])
+    print('* testing all monsters unique...')
+    unique_monsters(config, monster_names)
+
+    if has_errors:
+        print(red + '\nUnit test failed :(' + reset)
+    else:
+        print(green + '\n' + random.choice(("all systems go :)",
+            "ready to rock \'n roll :)", "all tests passed :)")) + reset)
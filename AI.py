@@ -76,9 +76,9 @@ class BasicMonsterAI(AI):
 
         #Only take action if we find the player
         if self.player is None:
-            for c in self.character.level.characters:
-                if type(c) is Player:
-                    self._player = c
+            myTile = self.character.tile
+            self._player = self.character.level.actorIndex.nearestActor(
+                    myTile.x, myTile.y, Player)
             if self.player is None:
                 message("   No player found, staying put", "AI")
                 return
@@ -107,7 +107,12 @@ class BasicMonsterAI(AI):
             return
         else:
             message("   Moving towards player", "AI")
-            self.character.moveTowards(self.player)
+            #follow the shared distance map towards the player if it reaches
+            #this far, find a path of our own otherwise
+            distanceMap = self.character.level.playerDistanceMap
+            if distanceMap is None \
+                    or not self.character.moveDownhill(distanceMap):
+                self.character.moveTowards(self.player)
             return
 
 
@@ -66,6 +66,10 @@ class Actor(object):
             self._tile.removeActor(self)
         self._tile = targetTile
         targetTile.addActor(self)
+        if self._level is not None:
+            self._level.actorIndex.moveActor(self, targetTile)
+        #the actor is visible if the tile it moved to is visible
+        self.inView = targetTile.inView
 
     _level = None
 
@@ -137,6 +141,10 @@ class Actor(object):
         """
         return self._color
 
+    #Cached path used by moveTowards(), list of tiles ending at _pathGoal
+    _path = None
+    _pathGoal = None
+
     #Constructor
     def __init__(self):
         """
@@ -152,6 +160,8 @@ class Actor(object):
         self._tile = None
         self._level = None
         self._color = (255, 255, 255)
+        self._path = None
+        self._pathGoal = None
 
     #functions
     def __str__(self):
@@ -213,21 +223,73 @@ class Actor(object):
 
     def moveTowards(self, targetActor):
         """
-        Moves this actor towards the provided actor.
+        Moves this actor one step along the path towards the provided actor.
+        The path is cached, it is only recalculated when the target moves
+        off the cached path.
         arguments
             actor - the target Actor object
         """
-        #vector towards the target
-        dx = targetActor.tile.x - self.tile.x
-        dy = targetActor.tile.y - self.tile.y
-        #distance towards the target
-        distance = Utilities.distanceBetween(self, targetActor)
-        #normalize it to length 1 (preserving direction), then round it and
-        #convert to integer so the movement is restricted to the map grid
-        dx = int(round(dx / distance))
-        dy = int(round(dy / distance))
-        #move along the vector
-        self.moveAlongVector(dx, dy)
+        targetTile = targetActor.tile
+        path = self._path
+        if path is not None and targetTile in path:
+            #the target moved along the path, no need to look any further
+            del path[path.index(targetTile) + 1:]
+        elif path is not None and len(path) == 0 \
+                and targetTile is self._pathGoal:
+            #the target is still unreachable
+            return
+        else:
+            path = None
+        #the next step has to be adjacent to where we are now
+        if path is not None and len(path) > 0:
+            nextTile = path[0]
+            if max(abs(nextTile.x - self.tile.x),
+                    abs(nextTile.y - self.tile.y)) != 1:
+                path = None
+        if path is None:
+            path = self.level.map.findPath(self.tile.x, self.tile.y,
+                    targetTile.x, targetTile.y)
+            if path is None:
+                path = []
+        self._path = path
+        self._pathGoal = targetTile
+        #move along the path, never onto the target itself
+        if len(path) > 1:
+            self.moveToTile(path.pop(0))
+
+    def forgetPath(self):
+        """
+        Drops the path cached by moveTowards(), for example because the
+        terrain changed.
+        """
+        self._path = None
+        self._pathGoal = None
+
+    def moveDownhill(self, distanceMap):
+        """
+        Moves this actor one step to the neighbouring tile with the lowest
+        distance on the distance map, never onto the destination itself.
+        Returns True if the actor moved.
+        arguments
+            distanceMap - dictionary of (x, y) positions to distances
+        """
+        x = self.tile.x
+        y = self.tile.y
+        currentDistance = distanceMap.get((x, y))
+        if currentDistance is None:
+            return False
+        bestTile = None
+        bestDistance = currentDistance
+        for dx, dy in ((0, -1), (0, 1), (-1, 0), (1, 0),
+                (-1, -1), (1, -1), (-1, 1), (1, 1)):
+            distance = distanceMap.get((x + dx, y + dy))
+            if distance is not None and 0 < distance < bestDistance:
+                bestTile = self.level.map.tiles[x + dx][y + dy]
+                bestDistance = distance
+        if bestTile is None:
+            return False
+        self.moveToTile(bestTile)
+        return True
 
     def takeDamage(self, amount, attacker):
         """
@@ -257,10 +319,17 @@ class Portal(Actor):
     @property
     def destinationPortal(self):
         """
-        The destination portal where this portal leads to
+        The destination portal where this portal leads to.
+        If the destination has not been generated yet, it is generated now.
         """
+        if self._destination is None and self._generator is not None:
+            generator = self._generator
+            self._generator = None
+            generator(self)
         return self._destination
 
+    _generator = None
+
     def __init__(self):
         """
         Constructor to create a new portal
@@ -276,6 +345,18 @@ class Portal(Actor):
         self._destination = otherPortal
         otherPortal._destination = self
 
+    def connectToGenerated(self, generator):
+        """
+        Connects this portal to a destination that is only generated when it
+        is needed for the first time.
+        arguments
+            generator - function that will be called with this portal as
+                        argument, it should create the destination portal
+                        and connect it to this portal.
+        """
+        self._destination = None
+        self._generator = generator
+
     def registerWithLevel(self, level):
         """
         Makes the level aware that this portal is on it.
@@ -888,7 +969,7 @@ class Consumable(Item):
         super(Consumable, self).__init__(item_data)
         #consumables usually have an effect
         if item_data['effect'] != '':
-            effect_class = eval("Effects." + item_data['effect'])
+            effect_class = getattr(Effects, item_data['effect'])
             newEffect = effect_class and effect_class(self) or None
             newEffect._effectHitDie = item_data['effecthitdie']
             self._effect = newEffect
@@ -17,6 +17,7 @@ import Utilities
 import textwrap
 import random
 import timeit
+import sys
 
 
 #actual size of the window
@@ -422,6 +423,50 @@ class ApplicationLibtcod():
         time = stop - start
         print 'Created ' +str(len(monsters)) + ' monsters in ' + str(time) + ' seconds'
 
+        #memory used by the tiles of a complete game world, before and after
+        #Tile used __slots__
+        class DictTile(object):
+            """
+            Replica of a tile with an instance dictionary and its own actor
+            list, like Tile before it used __slots__.
+            """
+            def __init__(self, tile):
+                self._map = tile.map
+                self._x = tile.x
+                self._y = tile.y
+                self._actors = list(tile.actors)
+
+        game = Game(self)
+        #follow the stairs down to generate every dungeon level, game.levels
+        #grows while it is iterated
+        for level in game.levels:
+            for portal in level.portals:
+                if portal.char == '>':
+                    portal.destinationPortal
+        levels = []
+        for level in game.levels:
+            levels.append(level)
+            levels.extend(level.subLevels)
+        tileCount = 0
+        tileBytes = 0
+        dictTileBytes = 0
+        for level in levels:
+            for column in level.map.tiles:
+                for tile in column:
+                    tileCount += 1
+                    tileBytes += sys.getsizeof(tile)
+                    if isinstance(tile.actors, list):
+                        tileBytes += sys.getsizeof(tile.actors)
+                    dictTile = DictTile(tile)
+                    dictTileBytes += sys.getsizeof(dictTile) + \
+                            sys.getsizeof(dictTile.__dict__) + \
+                            sys.getsizeof(dictTile._actors)
+        for label, size in (('Dictionary tiles', dictTileBytes),
+                ('Slotted tiles', tileBytes)):
+            print label + ': world of ' + str(len(levels)) + ' levels has ' + \
+                    str(tileCount) + ' tiles using ' + str(size / 1024) + \
+                    ' KiB (' + str(size / tileCount) + ' bytes per tile)'
+
 
         #myMap = Maps.TownMap(CONSTANTS.MAP_WIDTH, CONSTANTS.MAP_HEIGHT)
         #print myMap
@@ -447,6 +492,9 @@ class ApplicationLibtcod():
         con = self.mapConsole
         libtcod.console_clear(con)
         level = self.game.currentLevel
+        #screen position of the map
+        offsetX = level.map.offsetX
+        offsetY = level.map.offsetY
 
         # draw the map tiles
         for tile in level.map.explored_tiles:
@@ -465,7 +513,8 @@ class ApplicationLibtcod():
                 else:
                     bg_color = COLOR_DARK_GROUND
             libtcod.console_set_char_background(
-                con, tile.x, tile.y, bg_color, libtcod.BKGND_SET)
+                con, tile.x + offsetX, tile.y + offsetY, bg_color,
+                libtcod.BKGND_SET)
 
             # draw any actors standing on this tile.
             # includes Monsters and Portals
@@ -479,14 +528,14 @@ class ApplicationLibtcod():
                     elif type(myActor) is Actors.Monster:
                         actor_color = libtcod.green
                     libtcod.console_set_default_foreground(con, actor_color)
-                    libtcod.console_put_char(
-                        con, tile.x, tile.y, myActor.char, libtcod.BKGND_NONE)
+                    libtcod.console_put_char(con, tile.x + offsetX,
+                        tile.y + offsetY, myActor.char, libtcod.BKGND_NONE)
 
             #Redraw player character (makes sure it is on top)
             player = self.game.player
             libtcod.console_set_default_foreground(con, libtcod.white)
             libtcod.console_put_char(
-                con, player.tile.x, player.tile.y,
+                con, player.tile.x + offsetX, player.tile.y + offsetY,
                 player.char, libtcod.BKGND_NONE)
 
         #blit the contents of "con" to the root console
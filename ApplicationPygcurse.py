@@ -393,6 +393,9 @@ class ApplicationPygcurse():
         # hit a key.
         
         level = self.game.currentLevel
+        #screen position of the map
+        offsetX = level.map.offsetX
+        offsetY = level.map.offsetY
         for tile in level.map.explored_tiles:
             if tile.blocked:
                 # these are wall tiles
@@ -408,18 +411,21 @@ class ApplicationPygcurse():
                     bg_color = COLOR_LIGHT_GROUND
                 else:
                     bg_color = COLOR_DARK_GROUND
-            self.win.putchar(' ', tile.x, tile.y, bgcolor=bg_color)
+            self.win.putchar(' ', tile.x + offsetX, tile.y + offsetY,
+                    bgcolor=bg_color)
 
             # draw any actors standing on this tile.
             # includes Monsters and Portals
             for myActor in tile.actors:
                 if myActor.inView:
-                    self.win.putchar(myActor.char, tile.x, tile.y, fgcolor=myActor.color)
+                    self.win.putchar(myActor.char, tile.x + offsetX,
+                            tile.y + offsetY, fgcolor=myActor.color)
 
             #Redraw player character (makes sure it is on top)
             player = self.game.player
             self.win.putchar(
-                player.char, player.tile.x, player.tile.y, fgcolor=player.color)
+                player.char, player.tile.x + offsetX,
+                player.tile.y + offsetY, fgcolor=player.color)
 
         # show game messages via a PygcurseTextbox.
         message_box = pygcurse.PygcurseTextbox(
@@ -463,11 +469,13 @@ class ApplicationPygcurse():
         R, G, B = color
         for i in range (0,4):
             for tile in tiles:
-                self.win.settint(R, G, B,(tile.x, tile.y,1,1))
+                self.win.settint(R, G, B, (tile.x + tile.map.offsetX,
+                        tile.y + tile.map.offsetY, 1, 1))
             self.win.update()
             sleep(0.10)
             for tile in tiles:
-                self.win.settint(0, 0, 0,(tile.x, tile.y,1,1))
+                self.win.settint(0, 0, 0, (tile.x + tile.map.offsetX,
+                        tile.y + tile.map.offsetY, 1, 1))
             self.win.update()
             sleep(0.10)
 
@@ -14,6 +14,7 @@ MAP_HEIGHT = 43
 DUNGEON_ROOM_MAX_SIZE = 10
 DUNGEON_ROOM_MIN_SIZE = 6
 DUNGEON_MAX_ROOMS = 30
+DUNGEON_DEPTH = 7
 
 #town generation
 TOWN_HOUSE_MAX_SIZE = 14
@@ -24,6 +25,9 @@ TOWN_MAX_HOUSES = 18
 TORCH_RADIUS = 10
 TOWN_RADIUS = 30
 
+#monster AI, distance in steps up to which monsters track the player
+AI_TRACKING_DISTANCE = 16
+
 #experience and level-ups
 LEVEL_UP_BASE = 200
 LEVEL_UP_FACTOR = 150
@@ -33,3 +37,7 @@ MONSTER_CONFIG = "Game.conf"
 
 #config switches
 SHOW_AI_LOGGING = False
+#generate the next dungeon level in a background thread
+PREGENERATE_LEVELS = True
+#directory in which generated maps are cached, None disables the cache
+MAP_CACHE_DIRECTORY = None
@@ -0,0 +1,145 @@
+#!/usr/bin/python
+
+#Module with dice expressions like the hit dice in the config file
+
+import random
+import re
+import Utilities
+
+#NdS+M, N and M are optional, N defaults to 1
+_DICE_EXPRESSION = re.compile(
+        r'^\s*(\d*)\s*[dD]\s*(\d+)\s*(?:([+-])\s*(\d+))?\s*$')
+#a fixed number
+_CONSTANT_EXPRESSION = re.compile(r'^\s*([+-]?\d+)\s*$')
+
+#Cache of parsed dice expressions, see getDice()
+_dice = {}
+
+
+def getDice(expression):
+    """
+    Returns the Dice for an expression like "2d6", "1d8+2", "d20" or "3".
+    Every expression is parsed only once, the Dice objects are shared.
+    Raises a GameError if the expression can't be parsed.
+    """
+    dice = _dice.get(expression)
+    if dice is None:
+        match = _DICE_EXPRESSION.match(expression)
+        if match is not None:
+            count, sides, sign, modifier = match.groups()
+            modifier = int(modifier or 0)
+            if sign == '-':
+                modifier = -modifier
+            dice = Dice(int(count or 1), int(sides), modifier)
+        else:
+            match = _CONSTANT_EXPRESSION.match(expression)
+            if match is None:
+                raise Utilities.GameError(
+                        "Invalid dice expression: " + repr(expression))
+            dice = Dice(0, 1, int(match.group(1)))
+        _dice[expression] = dice
+    return dice
+
+
+class Dice(object):
+    """
+    A number of dice with the same number of sides and a fixed modifier,
+    for example 2d6+3.
+    """
+
+    _count = 0
+
+    @property
+    def count(self):
+        """
+        Number of dice that are rolled.
+        """
+        return self._count
+
+    _sides = 0
+
+    @property
+    def sides(self):
+        """
+        Number of sides of every die.
+        """
+        return self._sides
+
+    _modifier = 0
+
+    @property
+    def modifier(self):
+        """
+        Number added to the sum of the dice.
+        """
+        return self._modifier
+
+    @property
+    def minimum(self):
+        """
+        Lowest possible result.
+        """
+        return self._count + self._modifier
+
+    @property
+    def maximum(self):
+        """
+        Highest possible result.
+        """
+        return self._count * self._sides + self._modifier
+
+    def __init__(self, count, sides, modifier=0):
+        """
+        Constructor to create new dice.
+        Arguments
+            count - number of dice
+            sides - number of sides of every die
+            modifier - number added to the sum of the dice
+        """
+        if count < 0 or sides < 1:
+            raise Utilities.GameError("Invalid dice: " + str(count) + 'd' +
+                    str(sides))
+        self._count = count
+        self._sides = sides
+        self._modifier = modifier
+
+    def __str__(self):
+        if self.count == 0:
+            return str(self.modifier)
+        text = str(self.count) + 'd' + str(self.sides)
+        if self.modifier > 0:
+            text += '+' + str(self.modifier)
+        elif self.modifier < 0:
+            text += str(self.modifier)
+        return text
+
+    def roll(self, rng=random):
+        """
+        Rolls the dice and returns the result.
+        Arguments
+            rng - random number generator, the random module or a random.Random
+        """
+        draw = rng.random
+        sides = self._sides
+        total = self._modifier
+        for i in range(self._count):
+            total += int(draw() * sides) + 1
+        return total
+
+    def rollMany(self, n, rng=random):
+        """
+        Rolls the dice n times and returns the list of results. This draws
+        the same random numbers as n calls of roll(), but faster.
+        Arguments
+            n - number of rolls
+            rng - random number generator, the random module or a random.Random
+        """
+        draw = rng.random
+        sides = self._sides
+        count = self._count
+        modifier = self._modifier
+        if count == 1:
+            return [int(draw() * sides) + 1 + modifier for i in range(n)]
+        return [sum([int(draw() * sides) for die in range(count)])
+                + count + modifier
+                for i in range(n)]
@@ -5,6 +5,7 @@
 ######################
 
 import Utilities
+import Actors
 
 class EffectTarget:
     """
@@ -134,16 +135,19 @@ class NovaEffect(MagicEffect):
         damageAmount = Utilities.rollHitDie(self.effectHitDie)
         #find all tiles that are impacted by the nova
         sourceTile = novaSource.tile
+        radius = 2
         fullCircle = True
         excludeBlockedTiles = True
-        effectTiles = sourceTile.map.getCircleTiles(sourceTile.x, sourceTile.y, 2, fullCircle, excludeBlockedTiles)
+        effectTiles = sourceTile.map.getCircleTiles(sourceTile.x, sourceTile.y, radius, fullCircle, excludeBlockedTiles)
         #exclude the center of the nova
         effectTiles.remove(sourceTile)
-        #find all targets in range
-        targets = []
-        for tile in effectTiles:
-            for actor in tile.actors:
-                targets.append(actor)
+        #find all targets in range, circle tiles reach half a tile beyond
+        #the radius, keep the actors standing on one of the circle tiles
+        effectTileSet = set(effectTiles)
+        targets = [actor for actor in
+                novaSource.level.actorIndex.actorsWithinRadius(
+                    sourceTile.x, sourceTile.y, radius + 0.5, Actors.Actor)
+                if actor.tile in effectTileSet]
         #apply damage to every target
         for target in targets:
             target.takeDamage(damageAmount, novaSource)
@@ -40,6 +40,8 @@ from Effects import *
 
 #Load system modules
 import random
+import sys
+import threading
 
 ############# Classes related to User interface #################
 
@@ -147,16 +149,40 @@ class Game():
         """
         return self._itemLibrary
 
+    _seed = None
+
+    @property
+    def seed(self):
+        """
+        Master seed of this game, all levels are generated from seeds that
+        are derived from it.
+        """
+        return self._seed
+
+    #Seeds of the dungeon levels, fixed when the game is reset
+    _dungeonSeeds = []
+
+    #Background thread building the next dungeon level
+    _pregeneration = None
+
+    #Stairs leading down to the dungeon levels, by depth
+    _stairsDown = {}
+
     #constructor
-    def __init__(self, owner):
+    def __init__(self, owner, seed=None):
         """
         Constructor to create a new game.
         Arguments
             owner - Application object that owns this game
+            seed - optional master seed, the same seed always generates the
+                   same levels. A random seed is used if it is None.
         """
         #Initialize class variables
         self._application = owner
         self._player = None
+        if seed is None:
+            seed = random.getrandbits(32)
+        self._seed = seed
         #reset Game
         self.resetGame()
 
@@ -168,31 +194,21 @@ class Game():
 
         #clear existing levels
         self._levels = []
-        #generate new levels
-        prevLevel = None
         #generate a town level
-        town = TownLevel(self, 1, 'Town')
+        townRandom = random.Random(Utilities.deriveSeed(self.seed, 'town'))
+        town = TownLevel(self, 1, 'Town', townRandom)
         self._levels.append(town)
         self._currentLevel = town
-        for i in range(1, 8):
-            prevLevel = self.levels[i - 1]
-            curLevel = DungeonLevel(self, i , 'Dungeon level ' + str(i))
-            self._levels.append(curLevel)
-            if prevLevel is not None:
-                #add portal in previous level to current level
-                downPortal = Portal()
-                downPortal._char = '>'
-                downPortal._name = 'stairs leading down into darkness'
-                downPortal._message = 'You follow the stairs down, looking for more adventure.'
-                downPortal.moveToLevel(prevLevel, prevLevel.getRandomEmptyTile())
-                #add portal in current level to previous level
-                upPortal = Portal()
-                upPortal._char = '<'
-                upPortal._name = 'stairs leading up'
-                upPortal._message = 'You follow the stairs up, hoping to find the exit.'
-                upPortal.moveToLevel(curLevel, curLevel.getRandomEmptyTile())
-                #connect the two portals
-                downPortal.connectTo(upPortal)
+        #The dungeon levels are only generated when the player first follows
+        #the stairs down to them. Their seeds are derived from the master
+        #seed, this way the dungeon does not depend on when it gets generated.
+        self._dungeonSeeds = [
+                Utilities.deriveSeed(self.seed, 'dungeon', depth)
+                for depth in range(1, CONSTANTS.DUNGEON_DEPTH + 1)]
+        self._pregeneration = None
+        self._stairsDown = {}
+        self._addStairsDown(town, 1)
+        self._startPregeneration(1)
 
         #Create player object
         self._player = Player()
@@ -227,6 +243,88 @@ class Game():
 
         return
 
+    def _addStairsDown(self, level, depth):
+        """
+        Adds stairs on the given level leading down to the dungeon level at
+        the given depth. That level will be generated when the stairs are
+        followed for the first time.
+        """
+        downPortal = Portal()
+        downPortal._char = '>'
+        downPortal._name = 'stairs leading down into darkness'
+        downPortal._message = 'You follow the stairs down, looking for more adventure.'
+        downPortal.moveToLevel(level, level.getRandomEmptyTile())
+        downPortal.connectToGenerated(
+                lambda portal: self._generateDungeonLevel(depth, portal))
+        self._stairsDown[depth] = downPortal
+
+    def _buildDungeonLevel(self, depth):
+        """
+        Builds the dungeon level at the given depth from its seed, including
+        its stairs. Returns a tuple (level, stairs up).
+        All random choices are made by a random generator that belongs to
+        the level, this makes it safe to build a level in another thread.
+        """
+        rng = random.Random(self._dungeonSeeds[depth - 1])
+        level = DungeonLevel(self, depth, 'Dungeon level ' + str(depth), rng)
+        #add portal in this level to previous level
+        upPortal = Portal()
+        upPortal._char = '<'
+        upPortal._name = 'stairs leading up'
+        upPortal._message = 'You follow the stairs up, hoping to find the exit.'
+        upPortal.moveToLevel(level, level.getRandomEmptyTile())
+        #add portal to the next level
+        if depth < CONSTANTS.DUNGEON_DEPTH:
+            self._addStairsDown(level, depth + 1)
+        return (level, upPortal)
+
+    def _generateDungeonLevel(self, depth, downPortal):
+        """
+        Generates the dungeon level at the given depth and connects it to the
+        stairs leading down to it. If the level was built in the background
+        it is taken over from there.
+        """
+        result = None
+        pregeneration = self._pregeneration
+        if pregeneration is not None and pregeneration.depth == depth:
+            #wait for the background thread if it is not finished yet
+            pregeneration.join()
+            self._pregeneration = None
+            if pregeneration.error is not None:
+                #the failed thread may already have changed the game, building
+                #the level again could give a different level for the seed
+                errorType, error, errorTraceback = pregeneration.error
+                raise errorType, error, errorTraceback
+            result = pregeneration.result
+        if result is None:
+            result = self._buildDungeonLevel(depth)
+        level, upPortal = result
+        downPortal.connectTo(upPortal)
+        self._levels.append(level)
+        #get started on the level below
+        self._startPregeneration(depth + 1)
+        return level
+
+    def generateDungeon(self):
+        """
+        Generates all dungeon levels that have not been generated yet, as if
+        the player followed the stairs down to the bottom.
+        """
+        #following the stairs creates the levels, each level adds the stairs
+        #to the next one
+        for depth in range(1, CONSTANTS.DUNGEON_DEPTH + 1):
+            self._stairsDown[depth].destinationPortal
+
+    def _startPregeneration(self, depth):
+        """
+        Starts building the dungeon level at the given depth in a background
+        thread, so it is ready when the player takes the stairs down.
+        """
+        if not CONSTANTS.PREGENERATE_LEVELS or depth > CONSTANTS.DUNGEON_DEPTH:
+            return
+        self._pregeneration = LevelPregeneration(self, depth)
+        self._pregeneration.start()
+
     #TODO medium: implement saving and loading of gamestate
     def loadGame(self, fileName):
         return
@@ -238,10 +336,71 @@ class Game():
         """
         This function will handle one complete turn.
         """
+        #one distance map towards the player is shared by all monsters
+        self.currentLevel.updatePlayerDistanceMap(self.player)
         for c in self.currentLevel.characters:
             if c.state == Character.ACTIVE:
                 c.takeTurn()
 
+
+class LevelPregeneration(threading.Thread):
+    """
+    Background thread that builds a dungeon level ahead of time.
+    The game takes the result over once the thread has finished.
+    """
+
+    _depth = 0
+
+    @property
+    def depth(self):
+        """
+        The depth of the dungeon level that is being built.
+        """
+        return self._depth
+
+    _result = None
+
+    @property
+    def result(self):
+        """
+        Tuple (level, stairs up) of the built level, None until finished.
+        """
+        return self._result
+
+    _error = None
+
+    @property
+    def error(self):
+        """
+        The sys.exc_info() of the exception raised while building the
+        level, None if there was no error.
+        """
+        return self._error
+
+    def __init__(self, game, depth):
+        """
+        Constructor to create a new pregeneration thread.
+        Arguments
+            game - Game object that will own the level
+            depth - depth of the dungeon level to build
+        """
+        #This is not a daemon thread: daemon threads can still be running
+        #while the interpreter shuts down and then fail on the torn down
+        #modules. Building a level is quick, so waiting for it at exit is
+        #harmless.
+        super(LevelPregeneration, self).__init__()
+        self._game = game
+        self._depth = depth
+        self._result = None
+        self._error = None
+
+    def run(self):
+        try:
+            self._result = self._game._buildDungeonLevel(self.depth)
+        except Exception:
+            #raised again by the game when it takes the level over
+            self._error = sys.exc_info()
+
 if __name__ == '__main__':
     print("There is not much sense in running this file.")
     print("Try running ApplicationLibtcod.")
@@ -2,7 +2,9 @@
 
 import CONSTANTS
 import Utilities
-from Actors import Portal
+import math
+import random
+from Actors import Actor, Portal, Character, Player
 from Maps import *
 
 
@@ -50,6 +52,13 @@ class Level(object):
         """
         return self._map
 
+    @map.setter
+    def map(self, newMap):
+        if self._map is not None:
+            self._map.removeTerrainListener(self._terrainChanged)
+        self._map = newMap
+        newMap.addTerrainListener(self._terrainChanged)
+
     _portals = None
 
     @property
@@ -86,16 +95,52 @@ class Level(object):
         """
         return self._subLevels
 
+    _actorIndex = None
+
+    @property
+    def actorIndex(self):
+        """
+        Spatial index of the actors on this level.
+        """
+        return self._actorIndex
+
+    _playerDistanceMap = None
+
+    @property
+    def playerDistanceMap(self):
+        """
+        Dictionary of (x, y) positions to the number of steps towards the
+        player, shared by all monsters on this level. None if the player is
+        not on this level.
+        It is only calculated when it is asked for, levels without monsters
+        never need it.
+        """
+        if self._playerDistanceMap is None \
+                and self._playerDistanceMapOrigin is not None:
+            x, y = self._playerDistanceMapOrigin
+            self._playerDistanceMap = self.map.getDistanceMap(
+                    x, y, CONSTANTS.AI_TRACKING_DISTANCE)
+        return self._playerDistanceMap
+
+    #player position from which the distance map is calculated
+    _playerDistanceMapOrigin = None
+
+    #random number generator used for the random choices on this level
+    _random = random
+
     #constructor
-    def __init__(self, owner, difficulty, name):
+    def __init__(self, owner, difficulty, name, rng=random):
         """
         Constructor to create a new level.
         Arguments
             owner - Game object that owns this level
             difficulty - Difficulty of this level
             name - a textual name for this level
+            rng - random number generator used to generate this level, either
+                  the random module or a random.Random instance
         """
         #initialize class variables (makes them unique to this instance)
+        self._random = rng
         self._game = owner
         self._difficulty = difficulty
         self._name = name
@@ -103,6 +148,7 @@ class Level(object):
         self._characters = []
         self._items = []
         self._subLevels = []
+        self._actorIndex = ActorIndex()
 
     def removeActor(self, myActor):
         """
@@ -110,6 +156,7 @@ class Level(object):
         arguments
             myActor - the actor that should be removed
         """
+        self.actorIndex.removeActor(myActor)
         for c in self.characters:
             if c is myActor:
                 self.characters.remove(c)
@@ -117,6 +164,30 @@ class Level(object):
             if i is myActor:
                 self.items.remove(i)
 
+    def updatePlayerDistanceMap(self, player):
+        """
+        Forgets the distance map towards the player if the player moved, it
+        is calculated again the next time a monster asks for it.
+        This is meant to be done once per turn, before the monsters act.
+        """
+        if player is None or player.level is not self or player.tile is None:
+            self._playerDistanceMap = None
+            self._playerDistanceMapOrigin = None
+            return
+        origin = (player.tile.x, player.tile.y)
+        if origin != self._playerDistanceMapOrigin:
+            self._playerDistanceMap = None
+            self._playerDistanceMapOrigin = origin
+
+    def _terrainChanged(self, tile):
+        """
+        Called by the map when the terrain changes, paths that were
+        calculated before may no longer be valid.
+        """
+        self._playerDistanceMap = None
+        for character in self.characters:
+            character.forgetPath()
+
     def addPortal(self, portal):
         """
         Register the given portal to this level.
@@ -141,7 +212,7 @@ class Level(object):
         """
         if self.map is None:
             return None
-        return self.map.getRandomEmptyTile()
+        return self.map.getRandomEmptyTile(self._random)
 
 
 class DungeonLevel(Level):
@@ -149,76 +220,123 @@ class DungeonLevel(Level):
     Class representing a randomly generated dungeon level.
     """
     #constructor
-    def __init__(self, owner, difficulty, name):
+    def __init__(self, owner, difficulty, name, rng=random):
         """
         Constructor to create a new generated level.
         Arguments
             owner - Game object that owns this level
             difficulty - Difficulty of this level
             name - a textual name for this level
+            rng - random number generator used to generate this level
         """
         #call constructor of super class
-        super(DungeonLevel, self).__init__(owner, difficulty, name)
+        super(DungeonLevel, self).__init__(owner, difficulty, name, rng)
         #generate the map
-        self._map = DungeonMap(CONSTANTS.MAP_WIDTH, CONSTANTS.MAP_HEIGHT)
+        self.map = DungeonMap(CONSTANTS.MAP_WIDTH, CONSTANTS.MAP_HEIGHT, rng)
+        #decide which monsters and items go where, this uses the libraries
+        #of the game so unique monsters are only planned once per game
+        monsters, items = planDungeonSpawns(self.map,
+                self.game.monsterLibrary, self.game.itemLibrary,
+                difficulty, rng)
         #add some monsters
-        self._placeMonsters()
+        self._placeMonsters(monsters)
         #add some items
-        self._placeItems()
+        self._placeItems(items)
 
-    def _placeMonsters(self):
+    def _placeMonsters(self, monsters):
         """
-        This function will place monsters on this level depending on the
-        difficulty level and using the MonsterLibrary in the Game
+        This function will create the planned monsters using the
+        MonsterLibrary in the Game and place them on this level.
+        Arguments
+            monsters - list of (monster key, x, y, hitpoints) tuples
         """
         #Grab the MonsterLibrary
         lib = self.game.monsterLibrary
-        #max number of monsters per room
-        max_monsters = lib.getMaxMonstersPerRoomForDifficulty(self.difficulty)
-
-        #generate monsters for every room
-        for room in self.map.rooms:
-            #choose random number of monsters to create
-            num_monsters = random.randrange(0, max_monsters)
-            for i in range(num_monsters + 1):
-                #choose random spot for new monster
-                x = random.randrange(room.x1 + 1, room.x2 - 1)
-                y = random.randrange(room.y1 + 1, room.y2 - 1)
-                target_tile = self.map.tiles[x][y]
+        for key, x, y, hitPoints in monsters:
+            new_monster = lib.createMonster(key, self._random, hitPoints)
+            new_monster.moveToLevel(self, self.map.tiles[x][y])
 
-                #only place it if the tile is not blocked and empty
-                if not target_tile.blocked and target_tile.empty:
-
-                    # get a random monster
-                    new_monster = lib.getRandomMonster(self.difficulty)
-                    new_monster.moveToLevel(self, target_tile)
-
-    def _placeItems(self):
+    def _placeItems(self, items):
         """
-        This function will place items on this level depending on the
-        difficulty level and using the ItemLibrary in the Game
+        This function will create the planned items using the ItemLibrary in
+        the Game and place them on this level.
+        Arguments
+            items - list of (item key, x, y) tuples
         """
         #Grab the ItemLibrary
         lib = self.game.itemLibrary
-        #max number of items per room
-        max_items = lib.getMaxItemsPerRoomForDifficulty(self.difficulty)
-
-        #generate items for every room
-        for room in self.map.rooms:
-            #choose random number of items to create
-            num_items = random.randrange(0, max_items)
-            for i in range(num_items + 1):
-                #choose random spot for new item
-                x = random.randrange(room.x1 + 1, room.x2 - 1)
-                y = random.randrange(room.y1 + 1, room.y2 - 1)
-                target_tile = self.map.tiles[x][y]
+        for key, x, y in items:
+            new_item = lib.createItem(key)
+            new_item.moveToLevel(self, self.map.tiles[x][y])
 
-                #only place it if the tile is not blocked and empty
-                if not target_tile.blocked and target_tile.empty:
 
-                    # get a random item
-                    new_item = lib.getRandomItem(self.difficulty)
-                    new_item.moveToLevel(self, target_tile)
+def planDungeonSpawns(dungeonMap, monsterLibrary, itemLibrary, difficulty,
+        rng=random):
+    """
+    Decides which monsters and items will be placed where on a dungeon map,
+    depending on the difficulty level. The actors are not created, this only
+    needs the libraries to make the choices. Unique monsters that are chosen
+    are reserved in the monster library, they won't be chosen again.
+    Arguments
+        dungeonMap - the DungeonMap to populate
+        monsterLibrary - MonsterLibrary to choose the monsters from
+        itemLibrary - ItemLibrary to choose the items from
+        difficulty - Difficulty of the level
+        rng - random number generator used to make the choices
+    Returns
+        tuple of two lists:
+            - monsters as (monster key, x, y, hitpoints) tuples
+            - items as (item key, x, y) tuples
+    """
+    #positions that already received an actor
+    occupied = set()
+
+    def randomFreePositions(room, maxPerRoom):
+        #choose random number of actors to create
+        num_actors = rng.randrange(0, maxPerRoom)
+        for i in range(num_actors + 1):
+            #choose random spot for new actor
+            x = rng.randrange(room.x1 + 1, room.x2 - 1)
+            y = rng.randrange(room.y1 + 1, room.y2 - 1)
+            #only place it if the tile is not blocked and empty
+            if not dungeonMap.tiles[x][y].blocked and (x, y) not in occupied:
+                occupied.add((x, y))
+                yield (x, y)
+
+    #generate monsters for every room
+    monsters = []
+    max_monsters = monsterLibrary.getMaxMonstersPerRoomForDifficulty(difficulty)
+    for room in dungeonMap.rooms:
+        for x, y in randomFreePositions(room, max_monsters):
+            if not monsterLibrary.hasChoices(difficulty):
+                #all monsters of this difficulty are planned unique monsters
+                break
+            # get a random monster
+            key = monsterLibrary.getRandomMonsterKey(difficulty, rng)
+            if monsterLibrary.getPrototype(key).unique:
+                #don't plan the same unique monster again
+                monsterLibrary.reserveUniqueMonster(key)
+            monsters.append((key, x, y))
+    #roll the hitpoints of all monsters of the same type in one batch
+    indicesByKey = {}
+    for index, (key, x, y) in enumerate(monsters):
+        indicesByKey.setdefault(key, []).append(index)
+    hitPoints = [0] * len(monsters)
+    for key in sorted(indicesByKey):
+        indices = indicesByKey[key]
+        rolls = monsterLibrary.getHitDice(key).rollMany(len(indices), rng)
+        for index, roll in zip(indices, rolls):
+            hitPoints[index] = roll
+    monsters = [monster + (hp,) for monster, hp in zip(monsters, hitPoints)]
+
+    #generate items for every room
+    items = []
+    max_items = itemLibrary.getMaxItemsPerRoomForDifficulty(difficulty)
+    for room in dungeonMap.rooms:
+        for x, y in randomFreePositions(room, max_items):
+            # get a random item
+            items.append((itemLibrary.getRandomItemKey(difficulty, rng), x, y))
+    return (monsters, items)
 
 
 class TownLevel(Level):
@@ -227,18 +345,19 @@ class TownLevel(Level):
     """
 
     #constructor
-    def __init__(self, owner, difficulty, name):
+    def __init__(self, owner, difficulty, name, rng=random):
         """
         Constructor to create a new generated level.
         Arguments
             owner - Game object that owns this level
             difficulty - Difficulty of this level
             name - a textual name for this level
+            rng - random number generator used to generate this level
         """
         #call constructor of super class
-        super(TownLevel, self).__init__(owner, difficulty, name)
+        super(TownLevel, self).__init__(owner, difficulty, name, rng)
         #generate the map
-        self._map = TownMap(CONSTANTS.MAP_WIDTH, CONSTANTS.MAP_HEIGHT)
+        self.map = TownMap(CONSTANTS.MAP_WIDTH, CONSTANTS.MAP_HEIGHT, rng)
         #generate sublevels for the houses
         for house in self.map.houses:
             self.generateHouseInterior(house)
@@ -257,7 +376,7 @@ class TownLevel(Level):
                 for x in [house.x1, house.x2]
                 for y in range(house.y1 + 1, house.y2 - 1)]
         #Select actual location randomly
-        doorX, doorY = random.choice(doorLocations)
+        doorX, doorY = self._random.choice(doorLocations)
         doorTile = self.map.tiles[doorX][doorY]
         #Cut a hole in the wall for the door
         doorTile.blocked = False
@@ -269,9 +388,14 @@ class TownLevel(Level):
         doorIn._message = 'You enter the house.'
         doorIn.moveToLevel(self, doorTile)
         #Generate the level that represents the interior of the house
-        houseLevel = SingleRoomLevel(self.game, self.difficulty, 'house', house)
+        #it gets a random generator of its own, seeded from the town
+        houseRandom = random.Random(self._random.getrandbits(32))
+        houseLevel = SingleRoomLevel(self.game, self.difficulty, 'house',
+                house, houseRandom)
         self.subLevels.append(houseLevel)
-        doorTile = houseLevel.map.tiles[doorX][doorY]
+        houseMap = houseLevel.map
+        doorTile = houseMap.tiles[doorX - houseMap.offsetX][
+                doorY - houseMap.offsetY]
         #Create the door that leads out of the house
         doorOut = Portal()
         doorOut._char = '<'
@@ -288,9 +412,169 @@ class SingleRoomLevel(Level):
     It can for example be used to represent the interior of a house
     arguments
         area - the area that represents the room
+        rng - random number generator used for this level
     """
-    def __init__(self, owner, difficulty, name, area):
+    def __init__(self, owner, difficulty, name, area, rng=random):
         #call constructor of super class
-        super(SingleRoomLevel, self).__init__(owner, difficulty, name)
+        super(SingleRoomLevel, self).__init__(owner, difficulty, name, rng)
         #generate the map
-        self._map = SingleRoomMap(CONSTANTS.MAP_WIDTH, CONSTANTS.MAP_HEIGHT, area)
+        #the map only covers the room, it is shown at the position of the area
+        self.map = SingleRoomMap(CONSTANTS.MAP_WIDTH, CONSTANTS.MAP_HEIGHT,
+                area, rng, compact=True)
+
+
+class ActorIndex(object):
+    """
+    Spatial index of the actors on a level.
+    The level is divided in square cells, every cell keeps the actors that
+    are located in it bucketed by actor type. Actors keep the index up to
+    date when they move to another tile.
+    """
+
+    #width and height of a cell in tiles
+    CELL_SIZE = 8
+
+    def __init__(self):
+        """
+        Constructor to create a new empty index.
+        """
+        #dictionary of (cellX, cellY) to a dictionary of type to actors
+        self._cells = {}
+        #dictionary of actor to the (x, y) position where it is indexed
+        self._positions = {}
+        #(minX, minY, maxX, maxY) of the cells that ever contained an actor,
+        #it is never shrunk so it stays within the level
+        self._cellBounds = None
+
+    def moveActor(self, actor, tile):
+        """
+        Registers that the actor is now located on the given tile.
+        """
+        self.removeActor(actor)
+        self._positions[actor] = (tile.x, tile.y)
+        key = self._cellKey(tile.x, tile.y)
+        cell = self._cells.setdefault(key, {})
+        cell.setdefault(type(actor), []).append(actor)
+        cellX, cellY = key
+        bounds = self._cellBounds
+        if bounds is None:
+            self._cellBounds = (cellX, cellY, cellX, cellY)
+        elif not (bounds[0] <= cellX <= bounds[2]
+                and bounds[1] <= cellY <= bounds[3]):
+            self._cellBounds = (min(bounds[0], cellX), min(bounds[1], cellY),
+                    max(bounds[2], cellX), max(bounds[3], cellY))
+
+    def removeActor(self, actor):
+        """
+        Removes the actor from this index, if it is indexed.
+        """
+        position = self._positions.pop(actor, None)
+        if position is None:
+            return
+        key = self._cellKey(*position)
+        cell = self._cells[key]
+        bucket = cell[type(actor)]
+        bucket.remove(actor)
+        if len(bucket) == 0:
+            del cell[type(actor)]
+            if len(cell) == 0:
+                del self._cells[key]
+
+    def actorsAt(self, x, y, actorType=Actor):
+        """
+        Returns the actors of the given type located on position (x, y).
+        """
+        cell = self._cells.get(self._cellKey(x, y), {})
+        return [actor
+                for bucketType, bucket in cell.iteritems()
+                if issubclass(bucketType, actorType)
+                for actor in bucket
+                if self._positions[actor] == (x, y)]
+
+    def actorsWithinRadius(self, x, y, radius, actorType=Character):
+        """
+        Returns the actors of the given type that are located within radius
+        (euclidian distance) of position (x, y).
+        """
+        radiusSquared = radius * radius
+        #the radius doesn't have to be a whole number of tiles
+        reach = int(math.ceil(radius))
+        minX, minY = self._cellKey(x - reach, y - reach)
+        maxX, maxY = self._cellKey(x + reach, y + reach)
+        found = []
+        for cellX in range(minX, maxX + 1):
+            for cellY in range(minY, maxY + 1):
+                cell = self._cells.get((cellX, cellY))
+                if cell is None:
+                    continue
+                for bucketType, bucket in cell.iteritems():
+                    if not issubclass(bucketType, actorType):
+                        continue
+                    for actor in bucket:
+                        ax, ay = self._positions[actor]
+                        if (ax - x) ** 2 + (ay - y) ** 2 <= radiusSquared:
+                            found.append(actor)
+        return found
+
+    def nearestActor(self, x, y, actorType=Player):
+        """
+        Returns the actor of the given type that is nearest to position
+        (x, y), or None if there is no such actor on the level.
+        The cells are searched in rings around the cell of (x, y), until an
+        actor is found or the rings no longer touch a cell that ever
+        contained an actor.
+        """
+        if len(self._positions) == 0:
+            return None
+        centerX, centerY = self._cellKey(x, y)
+        minX, minY, maxX, maxY = self._cellBounds
+        maxRing = max(centerX - minX, maxX - centerX,
+                centerY - minY, maxY - centerY)
+        nearest = None
+        nearestDistance = None
+        for ring in range(maxRing + 1):
+            for cellKey in self._ringCellKeys(centerX, centerY, ring):
+                cell = self._cells.get(cellKey)
+                if cell is None:
+                    continue
+                for bucketType, bucket in cell.iteritems():
+                    if not issubclass(bucketType, actorType):
+                        continue
+                    for actor in bucket:
+                        ax, ay = self._positions[actor]
+                        distance = Utilities.distanceBetweenPoints(
+                                x, y, ax, ay)
+                        if nearest is None or distance < nearestDistance:
+                            nearest = actor
+                            nearestDistance = distance
+            #actors in the next ring are at least this far away
+            if nearest is not None and \
+                    nearestDistance <= ring * ActorIndex.CELL_SIZE:
+                break
+        return nearest
+
+    def _ringCellKeys(self, centerX, centerY, ring):
+        """
+        Returns the keys of the cells on the border of the square ring at
+        the given distance (in cells) around the center cell.
+        """
+        if ring == 0:
+            return [(centerX, centerY)]
+        minX = centerX - ring
+        maxX = centerX + ring
+        minY = centerY - ring
+        maxY = centerY + ring
+        keys = []
+        for cellX in range(minX, maxX + 1):
+            keys.append((cellX, minY))
+            keys.append((cellX, maxY))
+        for cellY in range(minY + 1, maxY):
+            keys.append((minX, cellY))
+            keys.append((maxX, cellY))
+        return keys
+
+    def _cellKey(self, x, y):
+        """
+        Returns the key of the cell that contains position (x, y).
+        """
+        return (x // ActorIndex.CELL_SIZE, y // ActorIndex.CELL_SIZE)
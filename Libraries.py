@@ -2,12 +2,90 @@
 
 import CONSTANTS
 import Utilities
+import random
 from Actors import *
+import Actors
 import AI
+import Dice
 
 #library/config file implementation
 import ConfigParser  # used for config file implementation
 import json  # used to load structured data like tables from strings
+import ast  # used to parse tuples like colors
+import os
+from collections import namedtuple
+
+
+#Compiled monster definition from the config file, the values are parsed and
+#the classes resolved so monsters can be created without reading the config.
+MonsterPrototype = namedtuple('MonsterPrototype', ['key', 'char', 'name',
+        'hitDice', 'color', 'defense', 'power', 'xp', 'unique', 'aiClass',
+        'flavor', 'killedBy'])
+
+#Compiled item definition from the config file. data holds the (option,
+#value) pairs that are passed to the constructor of itemClass as a dict.
+ItemPrototype = namedtuple('ItemPrototype', ['key', 'itemClass', 'data'])
+
+#Compiled config files shared by all libraries of this process, keyed by
+#(absolute path, modification time), see getCompiledConfig()
+_compiledConfigs = {}
+
+
+def getCompiledConfig(path):
+    """
+    Returns the CompiledConfig for a config file. The file is parsed only
+    once per process, it is parsed again after it has been modified.
+    Arguments
+        path - path of the config file
+    """
+    path = os.path.abspath(path)
+    try:
+        modified = os.path.getmtime(path)
+    except OSError:
+        modified = None
+    key = (path, modified)
+    compiled = _compiledConfigs.get(key)
+    if compiled is None:
+        config = ConfigParser.ConfigParser()
+        config.read(path)
+        compiled = CompiledConfig(config)
+        #forget older versions of the same file
+        for oldKey in [oldKey for oldKey in _compiledConfigs
+                if oldKey[0] == path]:
+            del _compiledConfigs[oldKey]
+        _compiledConfigs[key] = compiled
+    return compiled
+
+
+class CompiledConfig(object):
+    """
+    A parsed config file together with the data that libraries compile from
+    it, like prototypes and spawn tables. This data never changes once it has
+    been compiled, so it is shared by all libraries that use the same file.
+    """
+
+    _configParser = None
+
+    @property
+    def configParser(self):
+        return self._configParser
+
+    def __init__(self, myConfigParser):
+        """
+        Constructor to create a new compiled config.
+        Arguments
+            myConfigParser - config parser that has read the file
+        """
+        self._configParser = myConfigParser
+        self._libraryData = {}
+
+    def getLibraryData(self, libraryName):
+        """
+        Returns the dictionary with the compiled data of one kind of library.
+        Arguments
+            libraryName - name of the Library subclass
+        """
+        return self._libraryData.setdefault(libraryName, {})
 
 
 class Library(object):
@@ -29,20 +107,72 @@ class Library(object):
     def chancesDictionary(self):
         return self._chancesDictionary
 
+    #Spawn tables indexed by difficulty, see _initSpawnTables(). Higher
+    #difficulties use the entry of the deepest configured level.
+    _maxPerRoomTable = None
+    _samplerTable = None
+
+    _deepestLevel = 0
+
+    @property
+    def deepestLevel(self):
+        """
+        The highest difficulty that is configured in this library, the
+        spawn tables don't change for higher difficulties.
+        """
+        return self._deepestLevel
+
     #constructor
-    def __init__(self, myConfigParser):
+    def __init__(self, configPath):
         """
-        Constructor to create a new library based on a config parser.
+        Constructor to create a new library based on a config file.
         Arguments
-            config - an initialised config parser
+            configPath - path of the config file, it is parsed only once for
+                         all libraries in this process, see getCompiledConfig()
         """
         #initialize class variables
-        self._configParser = myConfigParser
+        compiled = getCompiledConfig(configPath)
+        self._configParser = compiled.configParser
+        #compiled data shared with the other libraries of the same class
+        self._compiledData = compiled.getLibraryData(type(self).__name__)
+        self._prototypes = self._compiledData.setdefault('prototypes', {})
+
+    #dictionary with the compiled data that is shared with other libraries
+    _compiledData = {}
+
+    #dictionary of key to the compiled prototype, see getPrototype()
+    _prototypes = {}
+
+    def getPrototype(self, key):
+        """
+        Returns the compiled prototype for the entry with the given key.
+        Every entry of the config file is compiled only once.
+        """
+        prototype = self._prototypes.get(key)
+        if prototype is None:
+            if not self.configParser.has_section(key):
+                raise Utilities.GameError('Unknown library entry ' + key)
+            prototype = self._compilePrototype(key,
+                    dict(self.configParser.items(key)))
+            self._prototypes[key] = prototype
+        return prototype
+
+    def _compilePrototype(self, key, data):
+        """
+        Place holder function, subclass must provide actual implementation.
+        Arguments
+            key - key of the entry in the config file
+            data - dictionary with the options of the entry
+        """
+        raise Utilities.GameError("Can't use Library class directly, use a subclass!")
 
     def _initChancesDictionary(self,names_list):
         """
         utility function to grab the list of chances for each item only once.
         """
+        self._chancesDictionary = self._compiledData.get('chances')
+        if self._chancesDictionary is not None:
+            return
         self._chancesDictionary = {}
         #Load the names in the dictionary
         self._chancesDictionary["names"] = names_list
@@ -50,6 +180,101 @@ class Library(object):
         for myName in self._chancesDictionary["names"]:
             chance_table = json.loads(self.configParser.get(myName, 'chance'))
             self._chancesDictionary[myName] = chance_table
+            #compile the entries that can be chosen at load time
+            self.getPrototype(myName)
+        self._compiledData['chances'] = self._chancesDictionary
+
+    def _initSpawnTables(self, maxPerRoomOption):
+        """
+        utility function to evaluate the tables that depend on the difficulty
+        only once, for every difficulty up to the deepest configured level.
+        Arguments
+            maxPerRoomOption - option in the lists section with the table of
+                               the maximum number of entries per room
+        """
+        #the initial sampler table is shared as well, _initSamplerTable()
+        #replaces the list instead of changing it
+        tables = self._compiledData.get('spawn tables')
+        if tables is not None:
+            (self._deepestLevel, self._maxPerRoomTable,
+                    self._samplerTable) = tables
+            return
+        maxPerRoom = json.loads(self.configParser.get('lists', maxPerRoomOption))
+        levels = [level for (value, level) in maxPerRoom]
+        for myName in self.chancesDictionary["names"]:
+            levels.extend(level for (value, level) in self.chancesDictionary[myName])
+        self._deepestLevel = max([0] + levels)
+        self._maxPerRoomTable = [self._fromDungeonLevel(maxPerRoom, difficulty)
+                for difficulty in range(self._deepestLevel + 1)]
+        self._initSamplerTable()
+        self._compiledData['spawn tables'] = (self._deepestLevel,
+                self._maxPerRoomTable, self._samplerTable)
+
+    def _initSamplerTable(self):
+        """
+        utility function to create a sampler for every difficulty.
+        """
+        possibilities = self._getPossibilities()
+        self._samplerTable = []
+        for difficulty in range(self.deepestLevel + 1):
+            #Determine chances for every possibility
+            chances = [self._fromDungeonLevel(
+                    self.chancesDictionary[possibility], difficulty)
+                    for possibility in possibilities]
+            if sum(chances) > 0:
+                sampler = Utilities.WeightedSampler(chances)
+            else:
+                sampler = None
+            self._samplerTable.append((possibilities, sampler))
+
+    def getMaxPerRoom(self, difficulty):
+        """
+        Returns the maximum number of entries per room for the difficulty.
+        """
+        #clamp to the configured levels
+        if difficulty > self._deepestLevel:
+            difficulty = self._deepestLevel
+        elif difficulty < 0:
+            difficulty = 0
+        return self._maxPerRoomTable[difficulty]
+
+    def hasChoices(self, difficulty):
+        """
+        Returns True if an entry of this library can be chosen at random for
+        the given difficulty, False if there is nothing to choose from. This
+        happens when all entries that occur at the difficulty are unique
+        monsters that have already been chosen.
+        """
+        #clamp to the configured levels
+        if difficulty > self._deepestLevel:
+            difficulty = self._deepestLevel
+        elif difficulty < 0:
+            difficulty = 0
+        return self._samplerTable[difficulty][1] is not None
+
+    def getSampler(self, difficulty):
+        """
+        Returns a tuple (possibilities, sampler) to choose random entries of
+        this library for the given difficulty. The sampler returns indices
+        into the list of possibilities.
+        Raises a GameError if nothing can be chosen at this difficulty.
+        """
+        #clamp to the configured levels
+        if difficulty > self._deepestLevel:
+            difficulty = self._deepestLevel
+        elif difficulty < 0:
+            difficulty = 0
+        entry = self._samplerTable[difficulty]
+        if entry[1] is None:
+            raise Utilities.GameError('Nothing to choose from at difficulty '
+                    + str(difficulty))
+        return entry
+
+    def _getPossibilities(self):
+        """
+        Returns the names of the entries that can be chosen at random.
+        """
+        return self.chancesDictionary["names"]
 
     def _fromDungeonLevel(self, table, difficulty):
         """
@@ -99,29 +324,31 @@ class MonsterLibrary(Library):
         """
         Constructor to create a new monster library
         """
-        #initialize configParser
-        config = ConfigParser.ConfigParser()
-        config.read(CONSTANTS.MONSTER_CONFIG)
         #call super class constructor
-        super(MonsterLibrary, self).__init__(config)
+        super(MonsterLibrary, self).__init__(CONSTANTS.MONSTER_CONFIG)
         #initialize class variables
         self._uniqueMonsters = []
         self._regularMonsters = []
+        #keys of unique monsters that are planned but maybe not created yet
+        self._reservedUniques = set()
         monsterList = self.configParser.get('lists', 'monster list').split(', ')
         self._initChancesDictionary(monsterList)
+        self._initSpawnTables('max monsters')
 
 
-    def createMonster(self, monster_key):
+    def createMonster(self, monster_key, rng=random, hitPoints=None):
         """
         Function to create and initialize a new Monster.
         Arguments
             monster_key - string that identifies a monster in the config file.
+            rng - random number generator used to roll the hitpoints
+            hitPoints - maximum hitpoints of the monster, rolled if None
         """
-        # load the monster data from the config
-        monster_data = dict(self.configParser.items(monster_key))
+        # load the compiled monster data
+        prototype = self.getPrototype(monster_key)
 
         # do not create multiple unique monsters
-        if monster_data['unique'] == 'True':
+        if prototype.unique:
             unique_ids = []
             for unique_monster in self.uniqueMonsters:
                 unique_ids.append(unique_monster.id)
@@ -129,66 +356,99 @@ class MonsterLibrary(Library):
                 #This unique was already created, do nothing
                 raise Utilities.GameError('Unique monster' + monster_key + ' already exists.')
 
-        #create the monster based on monster_data
+        #create the monster based on the prototype
         newMonster = Monster()
 
         #initialize all variables
         #Actor components
         newMonster._id = monster_key
-        newMonster._char = monster_data['char']
-        newMonster._baseMaxHitPoints = \
-                Utilities.rollHitDie(monster_data['hitdie'])
+        newMonster._char = prototype.char
+        if hitPoints is None:
+            hitPoints = prototype.hitDice.roll(rng)
+        newMonster._baseMaxHitPoints = hitPoints
         newMonster._currentHitPoints = newMonster._baseMaxHitPoints
-        newMonster._name = monster_data['name']
-        newMonster._color = eval(monster_data['color'])
+        newMonster._name = prototype.name
+        newMonster._color = prototype.color
         #Character components
 
-        newMonster._baseDefense = int(monster_data['defense'])
-        newMonster._basePower = int(monster_data['power'])
-        newMonster._xpValue = int(monster_data['xp'])
-        #gets a class object by name; and instanstiate it if not None
-        ai_class = eval('AI.' + monster_data['ai'])
+        newMonster._baseDefense = prototype.defense
+        newMonster._basePower = prototype.power
+        newMonster._xpValue = prototype.xp
+        #instantiate the AI if there is one
+        ai_class = prototype.aiClass
         newMonster._AI = ai_class and ai_class(newMonster) or None
 
         #Monster components
-        newMonster._flavorText = monster_data['flavor']
-        newMonster._killedByText = monster_data['killed_by']
+        newMonster._flavorText = prototype.flavor
+        newMonster._killedByText = prototype.killedBy
 
         # register the monster
-        if monster_data['unique'] == 'True':
+        if prototype.unique:
             self.uniqueMonsters.append(newMonster)
+            #this monster can no longer be chosen
+            self._initSamplerTable()
         else:
             self.regularMonsters.append(newMonster)
         return newMonster
 
     def getMaxMonstersPerRoomForDifficulty(self, difficulty):
         #maximum number of monsters per room
-        max_monsters = self._fromDungeonLevel(
-                json.loads(self.configParser.get('lists', 'max monsters')),
-                difficulty)
-        return max_monsters
+        return self.getMaxPerRoom(difficulty)
 
-    def getRandomMonster(self, difficulty):
-        #Determine possibilities
-        possibilities = self.chancesDictionary["names"]
-
-        #Avoid recreating unique monsters
-        for unique_monster in self.uniqueMonsters:
-            del possibilities[unique_monster.id]
+    def _compilePrototype(self, monster_key, monster_data):
+        """
+        Compiles the config data of a monster into a MonsterPrototype.
+        """
+        #gets the AI class object by name
+        ai_class = getattr(AI, monster_data['ai'])
+        return MonsterPrototype(
+                key=monster_key,
+                char=monster_data['char'],
+                name=monster_data['name'],
+                hitDice=Dice.getDice(monster_data['hitdie']),
+                color=tuple(ast.literal_eval(monster_data['color'])),
+                defense=int(monster_data['defense']),
+                power=int(monster_data['power']),
+                xp=int(monster_data['xp']),
+                unique=monster_data['unique'] == 'True',
+                aiClass=ai_class,
+                flavor=monster_data['flavor'],
+                killedBy=monster_data['killed_by'])
+
+    def getHitDice(self, monster_key):
+        """
+        Returns the Dice used to roll the hitpoints of the given monster type.
+        """
+        return self.getPrototype(monster_key).hitDice
 
-        #Determine chances for every possibility
-        chances = []
-        for possi in possibilities:
-            chanceTable = self.chancesDictionary[possi]
-            chance = self._fromDungeonLevel(chanceTable, difficulty)
-            chances.append(chance)
+    def getRandomMonster(self, difficulty, rng=random):
+        #create a random monster
+        return self.createMonster(
+                self.getRandomMonsterKey(difficulty, rng), rng)
 
+    def getRandomMonsterKey(self, difficulty, rng=random):
+        """
+        Returns the key of a random monster for the given difficulty.
+        """
         #randomly select a possibility
-        choice = possibilities[Utilities.randomChoiceIndex(chances)]
+        possibilities, sampler = self.getSampler(difficulty)
+        return possibilities[sampler.sample(rng)]
 
-        #create the monster
-        monster = self.createMonster(choice)
-        return monster
+    def reserveUniqueMonster(self, monster_key):
+        """
+        Marks a unique monster as planned, it won't be chosen at random
+        anymore even though it is not created yet.
+        Arguments
+            monster_key - string that identifies a unique monster
+        """
+        self._reservedUniques.add(monster_key)
+        self._initSamplerTable()
+
+    def _getPossibilities(self):
+        #Avoid recreating unique monsters
+        unique_ids = [monster.id for monster in self.uniqueMonsters]
+        return [name for name in self.chancesDictionary["names"]
+                if name not in unique_ids and name not in self._reservedUniques]
 
 
 class ItemLibrary(Library):
@@ -210,15 +470,13 @@ class ItemLibrary(Library):
         """
         Constructor to create a new item library
         """
-        #initialize configParser
-        config = ConfigParser.ConfigParser()
-        config.read(CONSTANTS.MONSTER_CONFIG)
         #call super class constructor
-        super(ItemLibrary, self).__init__(config)
+        super(ItemLibrary, self).__init__(CONSTANTS.MONSTER_CONFIG)
         #initialize class variables
         self._items = []
         ItemList = self.configParser.get('lists', 'item list').split(', ')
         self._initChancesDictionary(ItemList)
+        self._initSpawnTables('max items')
 
     def createItem(self, item_key):
         """
@@ -226,16 +484,11 @@ class ItemLibrary(Library):
         Arguments
             item_key - string that identifies an item in the config file.
         """
-        # load the item data from the config
-        item_data = dict(self.configParser.items(item_key))
-        item_data["key"] = item_key
+        # load the compiled item data
+        prototype = self.getPrototype(item_key)
 
         #create the correct type of item
-        item_class = eval(item_data['type'])
-        newItem = item_class and item_class(item_data) or None
-
-        if newItem is None:
-            raise Utilities.GameError('Failed to create item type ' + item_data['type'])
+        newItem = prototype.itemClass(dict(prototype.data))
 
         #initialize all variables
 
@@ -243,27 +496,33 @@ class ItemLibrary(Library):
         self.items.append(newItem)
         return newItem
 
+    def _compilePrototype(self, item_key, item_data):
+        """
+        Compiles the config data of an item into an ItemPrototype.
+        """
+        item_data["key"] = item_key
+        #the type is the name of an Item subclass
+        item_class = getattr(Actors, item_data['type'], None)
+        if not (isinstance(item_class, type) and issubclass(item_class, Item)):
+            raise Utilities.GameError('Failed to create item type ' + item_data['type'])
+        #parse the numbers
+        for option in ('defense_bonus', 'power_bonus'):
+            if option in item_data:
+                item_data[option] = int(item_data[option])
+        return ItemPrototype(item_key, item_class, tuple(item_data.items()))
+
     def getMaxItemsPerRoomForDifficulty(self, difficulty):
         #maximum number of items per room
-        max_items = self._fromDungeonLevel(
-                json.loads(self.configParser.get('lists', 'max items')),
-                difficulty)
-        return max_items
-
-    def getRandomItem(self, difficulty):
-        #Determine possibilities
-        possibilities = self.chancesDictionary["names"]
-
-        #Determine chances for every possibility
-        chances = []
-        for possi in possibilities:
-            chanceTable = self.chancesDictionary[possi]
-            chance = self._fromDungeonLevel(chanceTable, difficulty)
-            chances.append(chance)
+        return self.getMaxPerRoom(difficulty)
 
-        #randomly select a possibility
-        choice = possibilities[Utilities.randomChoiceIndex(chances)]
+    def getRandomItem(self, difficulty, rng=random):
+        #create a random item
+        return self.createItem(self.getRandomItemKey(difficulty, rng))
 
-        #create the item
-        item = self.createItem(choice)
-        return item
+    def getRandomItemKey(self, difficulty, rng=random):
+        """
+        Returns the key of a random item for the given difficulty.
+        """
+        #randomly select a possibility
+        possibilities, sampler = self.getSampler(difficulty)
+        return possibilities[sampler.sample(rng)]
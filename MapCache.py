@@ -0,0 +1,159 @@
+#!/usr/bin/python
+
+#Module with an on-disk cache of generated map layouts
+
+#Every cached map is a small file named after a hash of everything its
+#generation depends on: the map class, the map size, the generation
+#constants and the state of the random number generator before generation.
+#The tile matrices are stored with one bit per tile.
+
+import hashlib
+import mmap
+import os
+import struct
+import tempfile
+import CONSTANTS
+
+#version of the file format, bump it when the format or a map generator
+#changes so old cache files are no longer used
+CACHE_VERSION = 1
+
+_MAGIC = b'RLMC'
+#magic, version, width, height, number of areas, entry x, y, exit x, y
+_HEADER = struct.Struct('<4sHHHH4h')
+#x1, y1, x2, y2 of an area
+_AREA = struct.Struct('<4h')
+#state of a random generator: version, 625 words, gauss_next known, gauss_next
+_RANDOM_STATE = struct.Struct('<B625I?d')
+
+#the eight bits of every byte value as a string of 0 and 1 bytes
+_BYTE_BITS = [bytes(bytearray((value >> bit) & 1 for bit in range(8)))
+        for value in range(256)]
+
+
+def cacheKey(mapClass, width, height, rng):
+    """
+    Returns the key under which a generated map is cached.
+    Arguments
+        mapClass - the Map subclass, it lists the names of the constants
+                   that influence its generation in GENERATION_CONSTANTS
+        width, height - size of the map in tiles
+        rng - random number generator that will generate the map
+    """
+    constants = [(name, getattr(CONSTANTS, name))
+            for name in mapClass.GENERATION_CONSTANTS]
+    text = repr((CACHE_VERSION, mapClass.__name__, width, height,
+            constants, rng.getstate()))
+    return hashlib.sha1(text.encode('utf-8')).hexdigest()
+
+
+def _cachePath(key):
+    return os.path.join(CONSTANTS.MAP_CACHE_DIRECTORY, key + '.map')
+
+
+def _packBits(data):
+    """
+    Packs a string of 0 and 1 bytes into a bytearray with 8 values per byte.
+    """
+    bits = bytearray((len(data) + 7) // 8)
+    for index, value in enumerate(bytearray(data)):
+        if value:
+            bits[index >> 3] |= 1 << (index & 7)
+    return bits
+
+
+def _unpackBits(bits, count):
+    """
+    Unpacks count values packed by _packBits() into a string of 0 and 1 bytes.
+    """
+    return b''.join(_BYTE_BITS[value] for value in bytearray(bits))[:count]
+
+
+def load(key):
+    """
+    Reads a cached map layout.
+    Arguments
+        key - the key created by cacheKey()
+    Returns
+        tuple (layout fields, random state) or None if the map is not cached.
+        The layout fields are in the order of Maps.MapLayout, the random
+        state is the state of the generator after generating the map.
+    """
+    try:
+        with open(_cachePath(key), 'rb') as cacheFile:
+            mapped = mmap.mmap(cacheFile.fileno(), 0, access=mmap.ACCESS_READ)
+    except (EnvironmentError, ValueError):
+        return None
+    try:
+        return _readLayout(mapped)
+    except (struct.error, ValueError):
+        #unreadable cache file, it will be replaced
+        return None
+    finally:
+        mapped.close()
+
+
+def _readLayout(mapped):
+    (magic, version, width, height, areaCount,
+            entryX, entryY, exitX, exitY) = _HEADER.unpack_from(mapped, 0)
+    if magic != _MAGIC or version != CACHE_VERSION:
+        return None
+    offset = _HEADER.size
+    count = width * height
+    packedSize = (count + 7) // 8
+    matrices = []
+    for i in range(3):
+        matrices.append(_unpackBits(mapped[offset:offset + packedSize], count))
+        offset += packedSize
+    areas = []
+    for i in range(areaCount):
+        areas.append(_AREA.unpack_from(mapped, offset))
+        offset += _AREA.size
+    state = _RANDOM_STATE.unpack_from(mapped, offset)
+    randomState = (state[0], state[1:626], state[627] if state[626] else None)
+    entry = (entryX, entryY) if entryX >= 0 else None
+    exit = (exitX, exitY) if exitX >= 0 else None
+    blocked, blockSight, explored = matrices
+    return ((width, height, blocked, blockSight, explored, areas, entry,
+            exit), randomState)
+
+
+def store(key, layout, randomState):
+    """
+    Writes a map layout to the cache.
+    Arguments
+        key - the key created by cacheKey()
+        layout - the Maps.MapLayout of the generated map
+        randomState - state of the random generator after generating the map
+    """
+    entryX, entryY = layout.entry or (-1, -1)
+    exitX, exitY = layout.exit or (-1, -1)
+    parts = [_HEADER.pack(_MAGIC, CACHE_VERSION, layout.width, layout.height,
+            len(layout.areas), entryX, entryY, exitX, exitY)]
+    for data in (layout.blocked, layout.blockSight, layout.explored):
+        parts.append(bytes(_packBits(data)))
+    for area in layout.areas:
+        parts.append(_AREA.pack(*area))
+    version, words, gauss = randomState
+    parts.append(_RANDOM_STATE.pack(version, *(tuple(words) +
+            (gauss is not None, gauss or 0.0))))
+
+    #the cache is only an optimization, errors while writing are ignored
+    directory = CONSTANTS.MAP_CACHE_DIRECTORY
+    try:
+        if not os.path.isdir(directory):
+            os.makedirs(directory)
+        #write to a temporary file first, other processes should never see
+        #a half written cache file
+        handle, temporaryPath = tempfile.mkstemp(dir=directory)
+    except EnvironmentError:
+        return
+    try:
+        with os.fdopen(handle, 'wb') as cacheFile:
+            cacheFile.write(b''.join(parts))
+        os.rename(temporaryPath, _cachePath(key))
+    except EnvironmentError:
+        try:
+            os.remove(temporaryPath)
+        except EnvironmentError:
+            pass
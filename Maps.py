@@ -3,7 +3,69 @@
 import random
 import Utilities
 import CONSTANTS
+import Pathfinding
+import MapCache
 import math
+from collections import namedtuple
+
+
+#Compact description of a generated map, see Map.getLayout().
+#blocked, blockSight and explored hold one byte per tile, column by column,
+#areas is a list of (x1, y1, x2, y2) rectangles and entry and exit are
+#(x, y) positions or None.
+MapLayout = namedtuple('MapLayout', ['width', 'height', 'blocked',
+        'blockSight', 'explored', 'areas', 'entry', 'exit'])
+
+
+#Cache of circle offsets, see getCircleOffsets()
+_circleOffsets = {}
+
+
+def getCircleOffsets(radius, fullCircle=False):
+    """
+    Returns a tuple of (dx, dy) offsets relative to the center of a circle
+    with the given radius. A tile belongs to the circle if its center lies
+    within radius + 0.5 of the circle center. When fullCircle is false only
+    the outer ring of that disk is returned, the tiles that are further away
+    than radius - 0.5. Full circles start with the center (0, 0).
+    The offsets are calculated only once for every radius.
+    """
+    key = (radius, fullCircle)
+    offsets = _circleOffsets.get(key)
+    if offsets is None:
+        #(radius + 0.5) ** 2 = radius ** 2 + radius + 0.25 and squared
+        #distances are integers, this avoids floating point comparisons
+        outer = radius * radius + radius
+        inner = radius * radius - radius
+        offsets = [(dx, dy)
+                for dx in range(-radius, radius + 1)
+                for dy in range(-radius, radius + 1)
+                if dx * dx + dy * dy <= outer
+                and (fullCircle or dx * dx + dy * dy > inner)]
+        #order from the center outwards
+        offsets.sort(key=lambda offset:
+                (offset[0] ** 2 + offset[1] ** 2, offset))
+        offsets = tuple(offsets)
+        _circleOffsets[key] = offsets
+    return offsets
+
+
+#Cache of map positions, see getMapPositions()
+_mapPositions = {}
+
+
+def getMapPositions(width, height):
+    """
+    Returns a tuple of all (x, y) positions on a map of the given size,
+    column by column. The tuple is created only once for every map size and
+    shared by all maps of that size, so it must not be modified.
+    """
+    key = (width, height)
+    positions = _mapPositions.get(key)
+    if positions is None:
+        positions = tuple((x, y) for x in range(width) for y in range(height))
+        _mapPositions[key] = positions
+    return positions
 
 
 class Map(object):
@@ -49,27 +111,110 @@ class Map(object):
         else:
             return 0
 
+    #Position of the top left tile of this map in the coordinates of the
+    #screen and of the level it belongs to, for maps smaller than the screen
+    _offsetX = 0
+    _offsetY = 0
+
+    @property
+    def offsetX(self):
+        """
+        Horizontal position of the left column of this map on the screen.
+        """
+        return self._offsetX
+
+    @property
+    def offsetY(self):
+        """
+        Vertical position of the top row of this map on the screen.
+        """
+        return self._offsetY
+
     @property
     def each_map_position(self):
         """
-        Returns a 2D list that can be used to iterate over each map tile
+        Returns a tuple that can be used to iterate over each map tile
         x/y position:
 
-            for x, y in each_map_position():
+            for x, y in each_map_position:
                 pass
-        """
 
-        return [(x, y) for x in range(self.width) for y in range(self.height)]
+        The tuple is cached, see getMapPositions().
+        """
+        return getMapPositions(self.width, self.height)
 
     @property
     def explored_tiles(self):
         """
         Returns a list of all tiles explored.
         This includes tiles in and out of the visible range.
+        The list is kept up to date by the tiles, in the order in which they
+        were explored. It should not be modified.
+        """
+        return self._exploredTiles
+
+    #list of explored tiles, see explored_tiles
+    _exploredTiles = None
+
+    @property
+    def exploredCount(self):
+        """
+        Returns the number of explored tiles. Keep it to find out later
+        which tiles were explored since, see getTilesExploredSince().
+        """
+        return len(self._exploredTiles)
+
+    def getTilesExploredSince(self, exploredCount):
+        """
+        Returns the tiles that were explored since exploredCount was read,
+        for example by a renderer that remembers it every frame.
+        Arguments
+            exploredCount - an earlier value of the exploredCount property
+        """
+        return self._exploredTiles[exploredCount:]
+
+    #The state of the tiles is stored per property in a matrix of bytes,
+    #one bytearray per column, that can be accessed like matrix[x][y].
+    #The Tile objects are views on these matrices.
+    _blockedMatrix = None
+
+    @property
+    def blockedMatrix(self):
+        """
+        Returns the matrix of 1's and 0's that indicate if a tile position
+        is blocked.
         """
+        return self._blockedMatrix
 
-        # this flattens the 2D tiles list into one list, filtered out.
-        return [t for sublist in self.tiles for t in sublist if t.explored]
+    _blockSightMatrix = None
+
+    @property
+    def blockSightMatrix(self):
+        """
+        Returns the matrix of 1's and 0's that indicate if a tile position
+        blocks line of sight.
+        """
+        return self._blockSightMatrix
+
+    _exploredMatrix = None
+
+    @property
+    def exploredMatrix(self):
+        """
+        Returns the matrix of 1's and 0's that indicate if a tile position
+        has been explored.
+        """
+        return self._exploredMatrix
+
+    _inViewMatrix = None
+
+    @property
+    def inViewMatrix(self):
+        """
+        Returns the matrix of 1's and 0's that indicate if a tile position
+        is in view.
+        """
+        return self._inViewMatrix
 
     #Every map has a Tile object which contains the entry point
     _entryTile = None
@@ -100,70 +245,556 @@ class Map(object):
         """
         return self._rangeOfView
 
+    #field of view algorithms
+    FOV_RAYCASTING = 0
+    FOV_SHADOWCASTING = 1
+    _fovAlgorithm = FOV_SHADOWCASTING
+
+    @property
+    def fovAlgorithm(self):
+        """
+        The algorithm used to calculate the field of view on this map.
+        Either Map.FOV_RAYCASTING or Map.FOV_SHADOWCASTING.
+        """
+        return self._fovAlgorithm
+
+    @fovAlgorithm.setter
+    def fovAlgorithm(self, algorithm):
+        if algorithm not in (Map.FOV_RAYCASTING, Map.FOV_SHADOWCASTING):
+            raise Utilities.GameError("Unknown field of view algorithm")
+        self._fovAlgorithm = algorithm
+        self._clearPrecomputedVisibility()
+
+    _usePrecomputedVisibility = False
+
+    @property
+    def usePrecomputedVisibility(self):
+        """
+        Boolean indicating if this map remembers the field of view of every
+        position it was calculated for. This is meant for static maps, the
+        field of view of a position that was seen before becomes a lookup.
+        """
+        return self._usePrecomputedVisibility
+
+    @usePrecomputedVisibility.setter
+    def usePrecomputedVisibility(self, isUsed):
+        self._usePrecomputedVisibility = isUsed
+        self._clearPrecomputedVisibility()
+
+    #Dictionary of (x, y) viewer positions to a bitset of the visible tiles.
+    #Bit number x * height + y of the bitset represents tile (x, y).
+    _precomputedVisibility = None
+
+    #Bitset of the visible tiles, only kept when visibility is precomputed
+    _visibleBits = None
+
+    _visibleTiles = None
+
+    @property
+    def visibleTiles(self):
+        """
+        Returns the set of tiles that were in view after the last field of
+        view update.
+        """
+        return self._visibleTiles
+
+    #Position from which the current field of view was calculated
+    _viewerPosition = None
+
+    solidTileMatrix = None
+
+    #random number generator used to generate this map
+    _random = random
+
+    #Names of the CONSTANTS that influence generateMap(). Only maps of
+    #classes that list them are stored in the map cache.
+    GENERATION_CONSTANTS = None
+
+    #key of this map in the map cache
+    _cacheKey = None
+
     #constructor
-    def __init__(self, MapWidth, MapHeight):
+    def __init__(self, MapWidth, MapHeight, rng=random):
         """
         Constructor to create a new empty map
         Arguments
             MapWidth - Map width in tiles
             MapHeight - Map height in tiles
+            rng - random number generator used to generate the map, either
+                  the random module or a random.Random instance
         """
+        #Initialize random number generator
+        self._random = rng
         #Initialize range of view
         self._rangeOfView = CONSTANTS.TORCH_RADIUS
-        #Create a big empty map
-        self._tiles = [[Tile(map, x, y)
-            for y in range(MapHeight)]
-            for x in range(MapWidth)]
-        self.generateMap()
+        layout = self._loadCachedLayout(MapWidth, MapHeight)
+        if layout is None:
+            #Create a big empty map
+            self._createTiles(MapWidth, MapHeight)
+            self.generateMap()
+            if self._cacheKey is not None:
+                MapCache.store(self._cacheKey, self.getLayout(),
+                        self._random.getstate())
+        else:
+            self._applyLayout(layout)
         self.refreshBlockedTileMatrix()
+        self.refreshFreeTilePools()
 
     #functions
+    def _createTiles(self, width, height):
+        """
+        Creates a new grid of tiles with the state matrices backing them,
+        all tiles start empty and unexplored.
+        Arguments
+            width - Map width in tiles
+            height - Map height in tiles
+        """
+        def makeByteMatrix():
+            return [bytearray(height) for x in range(width)]
+        self._blockedMatrix = makeByteMatrix()
+        self._blockSightMatrix = makeByteMatrix()
+        self._exploredMatrix = makeByteMatrix()
+        self._inViewMatrix = makeByteMatrix()
+        self._tiles = [[Tile(self, x, y)
+            for y in range(height)]
+            for x in range(width)]
+        self._visibleTiles = set()
+        self._visibleBits = None
+        self._viewerPosition = None
+        self._freeTiles = None
+        self._refreshExploredTiles()
+
+    def _resetTiles(self, blocked=False, explored=False):
+        """
+        Resets the state of all tiles in place, the tiles and the matrices
+        backing them are reused. Map generators start from this.
+        Arguments
+            blocked - new value for blocked and blockSight of every tile
+            explored - new value for explored of every tile
+        """
+        def fillByteMatrix(matrix, value):
+            filled = bytearray([value]) * self.height
+            for column in matrix:
+                column[:] = filled
+        fillByteMatrix(self._blockedMatrix, blocked)
+        fillByteMatrix(self._blockSightMatrix, blocked)
+        fillByteMatrix(self._exploredMatrix, explored)
+        fillByteMatrix(self._inViewMatrix, False)
+        self._visibleTiles = set()
+        self._visibleBits = None
+        self._viewerPosition = None
+        self._freeTiles = None
+        self._refreshExploredTiles()
+
+    def _refreshExploredTiles(self):
+        """
+        Rebuilds the list of explored tiles from the explored matrix.
+        """
+        # scan the explored flags column by column, only tiles that are
+        # explored are looked up.
+        self._exploredTiles = [column[y]
+                for column, explored in zip(self.tiles, self._exploredMatrix)
+                for y, isExplored in enumerate(explored) if isExplored]
+
+    def tileExploredChanged(self, tile):
+        """
+        Notifies this map that a tile was explored or forgotten.
+        """
+        if tile.explored:
+            self._exploredTiles.append(tile)
+        else:
+            self._exploredTiles.remove(tile)
+
     def generateMap(self):
         """
         Place holder function, subclass must provide actual implementation.
         """
         raise GameError("Can't use Map class directly, use a subclass!")
 
+    def getLayout(self):
+        """
+        Returns a MapLayout describing this map. It only holds strings,
+        integers and tuples, the map cache stores it.
+        """
+        def packMatrix(matrix):
+            return b''.join(bytes(column) for column in matrix)
+
+        def position(tile):
+            if tile is None:
+                return None
+            return (tile.x, tile.y)
+
+        return MapLayout(self.width, self.height,
+                packMatrix(self._blockedMatrix),
+                packMatrix(self._blockSightMatrix),
+                packMatrix(self._exploredMatrix),
+                [(a.x1, a.y1, a.x2, a.y2) for a in self._areas or []],
+                position(self._entryTile),
+                position(self._exitTile))
+
+    def _loadCachedLayout(self, width, height):
+        """
+        Looks up the layout of this map in the map cache, if the cache is
+        enabled. On a hit the random generator of this map continues from
+        where the generation of the cached map ended.
+        Returns a MapLayout or None if the map has to be generated.
+        """
+        self._cacheKey = None
+        if CONSTANTS.MAP_CACHE_DIRECTORY is None \
+                or self.GENERATION_CONSTANTS is None:
+            return None
+        self._cacheKey = MapCache.cacheKey(type(self), width, height,
+                self._random)
+        cached = MapCache.load(self._cacheKey)
+        if cached is None:
+            return None
+        fields, randomState = cached
+        self._random.setstate(randomState)
+        return MapLayout(*fields)
+
+    def _applyLayout(self, layout):
+        """
+        Rebuilds this map from a MapLayout created by getLayout().
+        """
+        width, height = layout.width, layout.height
+        self._createTiles(width, height)
+
+        def unpackMatrix(data):
+            return [bytearray(data[x * height:(x + 1) * height])
+                    for x in range(width)]
+
+        self._blockedMatrix = unpackMatrix(layout.blocked)
+        self._blockSightMatrix = unpackMatrix(layout.blockSight)
+        self._exploredMatrix = unpackMatrix(layout.explored)
+        self._refreshExploredTiles()
+        self._areas = [Room(self, x1, y1, x2 - x1, y2 - y1)
+                for (x1, y1, x2, y2) in layout.areas]
+        if layout.entry is not None:
+            self._entryTile = self._tiles[layout.entry[0]][layout.entry[1]]
+        if layout.exit is not None:
+            self._exitTile = self._tiles[layout.exit[0]][layout.exit[1]]
+
     def refreshBlockedTileMatrix(self):
         """
         Refresh a 2D matrix of 1's and 0'1 that indicate if a Tile position
         blocks line of sight.
 
-        We could have looped over each tile and check this
-        for each player movement, but this way is neater and more efficient.
+        The tiles write their blockSight value straight into this matrix, so
+        it never has to be rebuilt tile by tile.
         """
 
-        self.solidTileMatrix = Utilities.make_matrix(self.width, self.height, 0)
-        for x, y in self.each_map_position:
-            self.solidTileMatrix[x][y] = self.tiles[x][y].blockSight
+        self.solidTileMatrix = self._blockSightMatrix
+
+    #callables that are notified of terrain changes, see addTerrainListener()
+    _terrainListeners = None
+
+    def addTerrainListener(self, listener):
+        """
+        Subscribes to terrain changes on this map. The listener is called
+        with the tile as argument whenever a tile becomes blocked or
+        unblocked or starts or stops blocking line of sight, for example
+        to invalidate cached paths.
+        Arguments
+            listener - callable that accepts a Tile
+        """
+        if self._terrainListeners is None:
+            self._terrainListeners = []
+        self._terrainListeners.append(listener)
+
+    def removeTerrainListener(self, listener):
+        """
+        Unsubscribes a listener added with addTerrainListener().
+        """
+        self._terrainListeners.remove(listener)
+
+    def tileTerrainChanged(self, tile):
+        """
+        Notifies this map that the blocked or blockSight state of a tile
+        changed. The state is already written to the matrices of the map,
+        this only informs the listeners.
+        """
+        if self._terrainListeners:
+            for listener in list(self._terrainListeners):
+                listener(tile)
+
+    def tileSightChanged(self, tile):
+        """
+        Notifies this map that a tile started or stopped blocking line of
+        sight. The field of view will be recalculated on the next update.
+        """
+        self._viewerPosition = None
+        self._clearPrecomputedVisibility()
+
+    def _clearPrecomputedVisibility(self):
+        """
+        Forgets all precomputed visibility bitsets.
+        """
+        if self.usePrecomputedVisibility:
+            self._precomputedVisibility = {}
+        else:
+            self._precomputedVisibility = None
 
     def updateFieldOfView(self, x, y):
         """
         Update the map tiles with what is in field of view, marking
         those as explored.
+        The field of view is only recalculated if the viewer moved or a tile
+        changed its line of sight blocking since the last update.
+        Returns a tuple of two lists:
+            - the tiles that came into view
+            - the tiles that went out of view
+        """
+        if self._viewerPosition == (x, y):
+            return ([], [])
+        self._viewerPosition = (x, y)
+
+        if self._precomputedVisibility is not None:
+            visibleBits = self._precomputedVisibility.get((x, y))
+            if visibleBits is None:
+                visibleBits = self._positionsToBits(
+                        self._calculateFieldOfView(x, y))
+                self._precomputedVisibility[(x, y)] = visibleBits
+            #only the tiles that changed need to be looked up
+            previousBits = self._visibleBits
+            if previousBits is None:
+                previousBits = self._positionsToBits(
+                        [(t.x, t.y) for t in self._visibleTiles])
+            leftTiles = self._bitsToTiles(previousBits & ~visibleBits)
+            enteredTiles = self._bitsToTiles(visibleBits & ~previousBits)
+            visibleTiles = self._visibleTiles.difference(leftTiles)
+            visibleTiles.update(enteredTiles)
+            self._visibleBits = visibleBits
+        else:
+            visibleTiles = set([self.tiles[tx][ty]
+                    for tx, ty in self._calculateFieldOfView(x, y)])
+            leftTiles = list(self._visibleTiles - visibleTiles)
+            enteredTiles = list(visibleTiles - self._visibleTiles)
+            self._visibleBits = None
+
+        #hide what went out of view
+        for tile in leftTiles:
+            tile.inView = False
+            for actor in tile.actors:
+                actor.inView = False
+        #show what came into view
+        for tile in enteredTiles:
+            tile.inView = True
+            tile.explored = True
+            # set all actors as in view too
+            for actor in tile.actors:
+                actor.inView = True
+        self._visibleTiles = visibleTiles
+        return (enteredTiles, leftTiles)
+
+    def _calculateFieldOfView(self, x, y):
+        """
+        Returns the set of visible (x, y) positions using the field of view
+        algorithm of this map.
+        """
+        if self.fovAlgorithm == Map.FOV_SHADOWCASTING:
+            return self._shadowcastFieldOfView(x, y)
+        else:
+            return self._raycastFieldOfView(x, y)
+
+    def _positionsToBits(self, positions):
         """
+        Converts a collection of (x, y) positions into a bitset.
+        """
+        height = self.height
+        bits = 0
+        for x, y in positions:
+            bits |= 1 << (x * height + y)
+        return bits
+
+    def _bitsToTiles(self, bits):
+        """
+        Returns the list of tiles that are set in a bitset.
+        """
+        height = self.height
+        tiles = self.tiles
+        result = []
+        #the binary string is reversed so the string index is the bit number
+        binary = bin(bits)[:1:-1]
+        index = binary.find('1')
+        while index != -1:
+            result.append(tiles[index // height][index % height])
+            index = binary.find('1', index + 1)
+        return result
+
+    def _raycastFieldOfView(self, x, y):
+        """
+        Returns the set of visible (x, y) positions by tracing a line of
+        sight towards every position on the map.
+        """
+        visiblePositions = set()
         view_range = self.rangeOfView
         for tx, ty in self.each_map_position:
-            tile = self.tiles[tx][ty]
             dist = Utilities.distanceBetweenPoints(x, y, tx, ty)
-            visible = dist <= view_range
-            line_of_sight = Utilities.line_of_sight(
-                self.solidTileMatrix, x, y, tx, ty)
-            if visible and line_of_sight:
-                tile.inView = True
-                tile.explored = True
+            if dist <= view_range and Utilities.line_of_sight(
+                    self.solidTileMatrix, x, y, tx, ty):
+                visiblePositions.add((tx, ty))
+        return visiblePositions
+
+    #multipliers to transform the coordinates of the first octant into
+    #the coordinates of the other seven octants.
+    _OCTANTS = ((1, 0, 0, -1, -1, 0, 0, 1),
+                (0, 1, -1, 0, 0, -1, 1, 0),
+                (0, 1, 1, 0, 0, -1, -1, 0),
+                (1, 0, 0, 1, -1, 0, 0, -1))
+
+    def _shadowcastFieldOfView(self, x, y):
+        """
+        Returns the set of visible (x, y) positions using recursive
+        shadowcasting. Only positions within range of view are visited and
+        scanning stops behind tiles that block line of sight.
+
+        Source: http://www.roguebasin.com/index.php?title=FOV_using_recursive_shadowcasting
+        """
+        visiblePositions = set([(x, y)])
+        for octant in range(8):
+            self._castLight(x, y, 1, 1.0, 0.0, self.rangeOfView,
+                    Map._OCTANTS[0][octant], Map._OCTANTS[1][octant],
+                    Map._OCTANTS[2][octant], Map._OCTANTS[3][octant],
+                    visiblePositions)
+        return visiblePositions
+
+    def _castLight(self, cx, cy, row, start, end, radius,
+            xx, xy, yx, yy, visiblePositions):
+        """
+        Recursive shadowcasting of a single octant, starting at the given row
+        and limited by the start and end slopes.
+        """
+        if start < end:
+            return
+        matrix = self.solidTileMatrix
+        width = self.width
+        height = self.height
+        radiusSquared = radius * radius
+        newStart = 0.0
+        for j in range(row, radius + 1):
+            dx = -j - 1
+            dy = -j
+            blocked = False
+            while dx <= 0:
+                dx += 1
+                #translate the relative dx, dy into map coordinates
+                mx = cx + dx * xx + dy * xy
+                my = cy + dx * yx + dy * yy
+                #slopes of the left and right extremities of this tile
+                leftSlope = (dx - 0.5) / (dy + 0.5)
+                rightSlope = (dx + 0.5) / (dy - 0.5)
+                if start < rightSlope:
+                    continue
+                elif end > leftSlope:
+                    break
+                #positions outside the map block everything
+                inMap = 0 <= mx < width and 0 <= my < height
+                if inMap and dx * dx + dy * dy <= radiusSquared:
+                    visiblePositions.add((mx, my))
+                solid = not inMap or matrix[mx][my]
+                if blocked:
+                    #scanning a row of blocking tiles
+                    if solid:
+                        newStart = rightSlope
+                        continue
+                    else:
+                        blocked = False
+                        start = newStart
+                elif solid and j < radius:
+                    #this is a blocking tile, start a child scan
+                    blocked = True
+                    self._castLight(cx, cy, j + 1, start, leftSlope, radius,
+                            xx, xy, yx, yy, visiblePositions)
+                    newStart = rightSlope
+            #stop scanning if the last tile of the row was blocking
+            if blocked:
+                break
+
+    def findPath(self, x1, y1, x2, y2, diagonalCost=1):
+        """
+        Returns the list of tiles that make up the cheapest path from
+        (x1, y1) to (x2, y2) avoiding blocked tiles. The start tile is not
+        included, the destination tile is. Returns None if there is no path.
+        Arguments
+            x1, y1 - start coordinates
+            x2, y2 - destination coordinates
+            diagonalCost - cost of a diagonal step, orthogonal steps cost 1.
+                           Use None to only allow orthogonal steps.
+        """
+        path = Pathfinding.findPath(
+                self.blockedMatrix, x1, y1, x2, y2, diagonalCost)
+        if path is None:
+            return None
+        return [self.tiles[x][y] for x, y in path]
+
+    def getDistanceMap(self, x, y, maxDistance):
+        """
+        Returns a dictionary of (x, y) positions to the number of steps it
+        takes to walk from there to (x, y), avoiding blocked tiles.
+        Positions further away than maxDistance steps are left out.
+        """
+        return Pathfinding.distanceMap(self.blockedMatrix, x, y, maxDistance)
+
+    #pools of free tiles, see refreshFreeTilePools()
+    _freeTiles = None
+    _freeAreaTiles = None
+    _areaPools = None
+
+    def refreshFreeTilePools(self):
+        """
+        Rebuilds the pools of free tiles: tiles that are not blocked and
+        hold no actors. There is one pool for the whole map, excluding the
+        outermost cells, one for every area and one combining all areas.
+        Afterwards the pools are kept up to date by the tiles.
+        """
+        self._freeTiles = TilePool()
+        self._freeAreaTiles = TilePool()
+        #dictionary of tile to the pools of the areas that contain it
+        self._areaPools = {}
+        for area in self.areas or []:
+            area._freeTiles = TilePool()
+            for x in range(max(area.x1, 0), min(area.x2 + 1, self.width)):
+                for y in range(max(area.y1, 0), min(area.y2 + 1, self.height)):
+                    self._areaPools.setdefault(self.tiles[x][y], []).append(
+                            area.freeTiles)
+        #the pools start empty, only the unblocked tiles have to be added
+        for x in range(self.width):
+            column = self.blockedMatrix[x]
+            for y in range(self.height):
+                if not column[y]:
+                    self.tileOccupancyChanged(self.tiles[x][y])
+
+    def tileOccupancyChanged(self, tile):
+        """
+        Notifies this map that a tile got blocked or unblocked or that actors
+        entered or left it, so the pools of free tiles can be updated.
+        """
+        if self._freeTiles is None:
+            #pools are built after the map is generated
+            return
+        isFree = not tile.blocked and tile.empty
+        inMapPool = 0 < tile.x < self.width - 1 and 0 < tile.y < self.height - 1
+        areaPools = self._areaPools.get(tile, [])
+        if len(areaPools) > 0:
+            pools = [self._freeAreaTiles] + areaPools
+        else:
+            pools = []
+        if inMapPool:
+            pools.append(self._freeTiles)
+        for pool in pools:
+            if isFree:
+                pool.add(tile)
             else:
-                self.tiles[tx][ty].inView = False
-            # set all actors as in view too
-            for actor in tile.actors:
-                actor.inView = visible and line_of_sight
+                pool.remove(tile)
 
-    def getRandomEmptyTile(self):
+    def getRandomEmptyTile(self, rng=random):
         """
         Returns an empty tile on this level, excluding the outermost cells.
+        Returns None if there is no such tile.
+        Arguments
+            rng - random number generator used to pick the tile
         """
-        levelArea = Room(self, 1, 1, self.width - 2, self.height - 2)
-        return levelArea.getRandomEmptyTile()
+        return self._freeTiles.randomTile(rng)
 
     def getCircleTiles(self, x, y, radius, fullCircle=False, excludeBlockedTiles=False):
         """
@@ -177,53 +808,22 @@ class Map(object):
                 circle are returned, when true all tiles inside.
             excludeBlockedTiles - excludes blocked tiles
         """
-        #prepare variables
         circleTiles = []
-        maxX = self.width - 1
-        maxY = self.height - 1
-        #maxI is a relevant sample size, if it is to small it will lead to gaps in the circle.
-        #the following works for reasonably sized circles.
-        maxI = 6 * radius
-        halfMaxI = maxI / 2
-        if fullCircle:
-            #add center
-            circleTiles.append(self.tiles[x][y])
-        #go around the edge of the circle in maxI samples
-        for i in range(0, maxI):
-            #for each edge sample calculate the coordinates
-            xPos = int(round(x + radius * math.cos((math.pi/halfMaxI)*i)))
-            yPos = int(round(y + radius * math.sin((math.pi/halfMaxI)*i)))
-            #add relevant tiles between the found circle edge and the circle center
-            while xPos <> x or yPos <> y:
-                #tile has to be on the map
-                if xPos >= 0 and yPos >= 0 and xPos <= maxX and yPos <= maxY:
-                    #avoid adding duplicates
-                    if self.tiles[xPos][yPos] not in circleTiles:
-                        possibleTile = self.tiles[xPos][yPos]
-                        if excludeBlockedTiles:
-                            #exclude blocked tiles
-                            if not possibleTile.blocked:
-                                circleTiles.append(possibleTile)
-                        else:
-                            #include all tiles
-                            circleTiles.append(possibleTile)
-                if fullCircle:
-                    #move towards interior
-                    if xPos > x:
-                        xPos -= 1
-                    elif xPos < x:
-                        xPos += 1
-                    elif xPos == x:
-                        if yPos > y:
-                            yPos -= 1
-                        elif yPos < y:
-                            yPos += 1
-                else:
-                    #adding only the edge is enough
-                    break        
-        #return the found tiles that make up the circle   
+        width = self.width
+        height = self.height
+        blocked = self.blockedMatrix
+        for dx, dy in getCircleOffsets(radius, fullCircle):
+            tx = x + dx
+            ty = y + dy
+            #tile has to be on the map
+            if tx < 0 or ty < 0 or tx >= width or ty >= height:
+                continue
+            #the center is always included in a full circle
+            if excludeBlockedTiles and blocked[tx][ty] and (dx or dy):
+                continue
+            circleTiles.append(self.tiles[tx][ty])
         return circleTiles
-    
+
     def __str__(self):
         """
         Basic way to print out a map, can be used to debug.
@@ -244,6 +844,9 @@ class DungeonMap(Map):
     """
     This class represents a randomized dungeon map.
     """
+    GENERATION_CONSTANTS = ('DUNGEON_ROOM_MAX_SIZE', 'DUNGEON_ROOM_MIN_SIZE',
+            'DUNGEON_MAX_ROOMS')
+
     @property
     def rooms(self):
         """
@@ -259,14 +862,15 @@ class DungeonMap(Map):
         """
         self._areas = []
 
-    def __init__(self, MapWidth, MapHeight):
+    def __init__(self, MapWidth, MapHeight, rng=random):
         """
         Constructor to create a new dungeon map
         Arguments
             MapWidth - Map width in tiles
             MapHeight - Map height in tiles
+            rng - random number generator used to generate the map
         """
-        super(DungeonMap, self).__init__(MapWidth, MapHeight)
+        super(DungeonMap, self).__init__(MapWidth, MapHeight, rng)
         #Initialize range of view
         self._rangeOfView = CONSTANTS.TORCH_RADIUS
 
@@ -282,27 +886,18 @@ class DungeonMap(Map):
         ROOM_MIN_SIZE = CONSTANTS.DUNGEON_ROOM_MIN_SIZE
         MAX_ROOMS = CONSTANTS.DUNGEON_MAX_ROOMS
 
-        #Create a new map with empty tiles
-        self._tiles = [[Tile(self, x, y)
-               for y in range(self. height)]
-           for x in range(self. width)]
-
-        #Block all tiles
-        for y in range(self.height):
-            for x in range(self.width):
-                myTile = self.tiles[x][y]
-                myTile.blocked = True
-                myTile.blockSight = True
+        #Start from a map with all tiles blocked
+        self._resetTiles(blocked=True)
 
         #cut out rooms
         num_rooms = 0
         for r in range(MAX_ROOMS):
             #random width and height
-            w = random.randrange(ROOM_MIN_SIZE, ROOM_MAX_SIZE)
-            h = random.randrange(ROOM_MIN_SIZE, ROOM_MAX_SIZE)
+            w = self._random.randrange(ROOM_MIN_SIZE, ROOM_MAX_SIZE)
+            h = self._random.randrange(ROOM_MIN_SIZE, ROOM_MAX_SIZE)
             #random position without going out of the boundaries of the map
-            x = random.randrange(0, self.width - w - 1)
-            y = random.randrange(0, self.height - h - 1)
+            x = self._random.randrange(0, self.width - w - 1)
+            y = self._random.randrange(0, self.height - h - 1)
             #create a new room
             new_room = Room(self, x, y, w, h)
 
@@ -332,7 +927,7 @@ class DungeonMap(Map):
                 (prev_x, prev_y) = self.rooms[num_rooms - 1].center
 
                 #create a corridor
-                if random.randrange(0, 1) == 1:
+                if self._random.randrange(0, 1) == 1:
                     #first move vertically, then horizontally
                     self._createVerticalTunnel(prev_x, new_x, prev_y)
                     self._createHorizontalTunnel(prev_y, new_y, new_x)
@@ -363,23 +958,23 @@ class DungeonMap(Map):
             self.tiles[x][y].blocked = False
             self.tiles[x][y].blockSight = False
 
-    def getRandomEmptyTile(self):
+    def getRandomEmptyTile(self, rng=random):
         """
-        finds a random empty tile on the map of this level
+        finds a random empty tile in one of the rooms of this map.
+        Returns None if all rooms are full.
+        Arguments
+            rng - random number generator used to pick the tile
         """
-        emptyTile = None
-        while emptyTile is None:
-            #pick a random room of the map
-            room = random.choice(self.rooms)
-            #find an empty tile in the room
-            emptyTile = room.getRandomEmptyTile()
-        return emptyTile
+        return self._freeAreaTiles.randomTile(rng)
 
 
 class TownMap(Map):
     """
     This class represents a randomized town map.
     """
+    GENERATION_CONSTANTS = ('TOWN_HOUSE_MAX_SIZE', 'TOWN_HOUSE_MIN_SIZE',
+            'TOWN_MAX_HOUSES')
+
     @property
     def houses(self):
         """
@@ -395,16 +990,19 @@ class TownMap(Map):
         """
         self._areas = []
 
-    def __init__(self, MapWidth, MapHeight):
+    def __init__(self, MapWidth, MapHeight, rng=random):
         """
         Constructor to create a new town map
         Arguments
             MapWidth - Map width in tiles
             MapHeight - Map height in tiles
+            rng - random number generator used to generate the map
         """
-        super(TownMap, self).__init__(MapWidth, MapHeight)
+        super(TownMap, self).__init__(MapWidth, MapHeight, rng)
         #Initialize range of view
         self._rangeOfView = CONSTANTS.TOWN_RADIUS
+        #The town does not change, remember the field of view
+        self.usePrecomputedVisibility = True
 
     def generateMap(self):
         """
@@ -418,33 +1016,28 @@ class TownMap(Map):
         HOUSE_MIN_SIZE = CONSTANTS.TOWN_HOUSE_MIN_SIZE
         MAX_HOUSES = CONSTANTS.TOWN_MAX_HOUSES
 
-        #Create a new map with empty tiles
-        self._tiles = [[Tile(self, x, y)
-               for y in range(self. height)]
-           for x in range(self. width)]
+        #Start from a map with explored empty tiles
+        self._resetTiles(explored=True)
 
         #Block only the town border
+        for x in range(self.width):
+            for y in [0, self.height - 1]:
+                self.tiles[x][y].blocked = True
+                self.tiles[x][y].blockSight = True
         for y in range(self.height):
-            for x in range(self.width):
-                myTile = self.tiles[x][y]
-                myTile.explored = True
-                if x == 0 or y == 0 \
-                        or x == self.width - 1 or y == self.height - 1:
-                    myTile.blocked = True
-                    myTile.blockSight = True
-                else:
-                    myTile.blocked = False
-                    myTile.blockSight = False
+            for x in [0, self.width - 1]:
+                self.tiles[x][y].blocked = True
+                self.tiles[x][y].blockSight = True
 
         #generate houses
         num_houses = 0
         for r in range(MAX_HOUSES):
             #random width and height
-            w = random.randrange(HOUSE_MIN_SIZE, HOUSE_MAX_SIZE)
-            h = random.randrange(HOUSE_MIN_SIZE, HOUSE_MAX_SIZE)
+            w = self._random.randrange(HOUSE_MIN_SIZE, HOUSE_MAX_SIZE)
+            h = self._random.randrange(HOUSE_MIN_SIZE, HOUSE_MAX_SIZE)
             #random position staying away from the edges of town
-            x = random.randrange(2, self.width - w - 2)
-            y = random.randrange(2, self.height - h - 2)
+            x = self._random.randrange(2, self.width - w - 2)
+            y = self._random.randrange(2, self.height - h - 2)
             #create a new house
             new_house = Room(self, x, y, w, h)
 
@@ -476,6 +1069,9 @@ class SingleRoomMap(Map):
     """
     _room = None
 
+    #number of wall tiles around the room on a compact map
+    MARGIN = 1
+
     @property
     def room(self):
         """
@@ -483,31 +1079,36 @@ class SingleRoomMap(Map):
         """
         return self._room
 
-    def __init__(self, MapWidth, MapHeight, myRoom):
+    def __init__(self, MapWidth, MapHeight, myRoom, rng=random,
+            compact=False):
         """
         Constructor to create a new empty map
         Arguments
             MapWidth - Map width in tiles
             MapHeight - Map height in tiles
-        """
-        #Register room
-        self._room = myRoom
-        super(SingleRoomMap, self).__init__(MapWidth, MapHeight)
+            myRoom - the room that makes up this map
+            rng - random number generator used for this map
+            compact - if True the map is only as large as the room and a
+                      margin of MARGIN wall tiles. MapWidth and MapHeight
+                      are ignored, offsetX and offsetY hold the position
+                      of the map so the room stays where myRoom is.
+        """
+        if compact:
+            self._offsetX = myRoom.x1 - self.MARGIN
+            self._offsetY = myRoom.y1 - self.MARGIN
+            MapWidth = myRoom.x2 - myRoom.x1 + 1 + 2 * self.MARGIN
+            MapHeight = myRoom.y2 - myRoom.y1 + 1 + 2 * self.MARGIN
+        #Register room, in the coordinates of this map
+        self._room = Room(self, myRoom.x1 - self.offsetX,
+                myRoom.y1 - self.offsetY, myRoom.x2 - myRoom.x1,
+                myRoom.y2 - myRoom.y1)
+        super(SingleRoomMap, self).__init__(MapWidth, MapHeight, rng)
         #Initialize range of view
         self._rangeOfView = CONSTANTS.TORCH_RADIUS
 
     def generateMap(self):
-        #Create a new map with empty tiles
-        self._tiles = [[Tile(self, x, y)
-               for y in range(self. height)]
-           for x in range(self. width)]
-
-        #Block all tiles
-        for y in range(self.height):
-            for x in range(self.width):
-                myTile = self.tiles[x][y]
-                myTile.blocked = True
-                myTile.blockSight = True
+        #Start from a map with all tiles blocked
+        self._resetTiles(blocked=True)
 
         #Cut out the single room
         for x in range(self.room.x1, self.room.x2 + 1):
@@ -547,25 +1148,94 @@ class Room():
                 and
                 self.y1 - border <= other.y2 and self.y2 + border >= other.y1)
 
-    def getRandomEmptyTile(self):
-        aTile = None
-        xRange = range(self.x1, self.x2 + 1)
-        random.shuffle(xRange)
-        yRange = range(self.y1, self.y2 + 1)
-        random.shuffle(yRange)
-        for x in xRange:
-            for y in yRange:
-                if not self._map.tiles[x][y].blocked and self._map.tiles[x][y].empty:
-                    aTile = self._map.tiles[x][y]
-        return aTile
+    _freeTiles = None
 
+    @property
+    def freeTiles(self):
+        """
+        Pool of the tiles in this room that are not blocked and empty.
+        This is maintained by the map once it is generated.
+        """
+        return self._freeTiles
 
-class Tile():
+    def getRandomEmptyTile(self, rng=random):
+        """
+        Returns a random empty tile in this room or None if there is none.
+        Arguments
+            rng - random number generator used to pick the tile
+        """
+        if self.freeTiles is not None:
+            return self.freeTiles.randomTile(rng)
+        #the map doesn't keep a pool for this room
+        tiles = [self._map.tiles[x][y]
+                for x in range(self.x1, self.x2 + 1)
+                for y in range(self.y1, self.y2 + 1)]
+        rng.shuffle(tiles)
+        for aTile in tiles:
+            if not aTile.blocked and aTile.empty:
+                return aTile
+        return None
+
+
+class TilePool(object):
     """
-    represents a Tile on the map
+    Set of tiles that can return a random tile in constant time.
+    The tiles are kept in a list, a dictionary remembers the position of each
+    tile in the list so it can be removed in constant time as well.
     """
 
-    _x = 0
+    def __init__(self):
+        """
+        Constructor to create a new empty pool.
+        """
+        self._tiles = []
+        self._positions = {}
+
+    def __len__(self):
+        return len(self._tiles)
+
+    def __contains__(self, tile):
+        return tile in self._positions
+
+    def add(self, tile):
+        """
+        Adds a tile to this pool, if it is not in it yet.
+        """
+        if tile not in self._positions:
+            self._positions[tile] = len(self._tiles)
+            self._tiles.append(tile)
+
+    def remove(self, tile):
+        """
+        Removes a tile from this pool, if it is in it.
+        """
+        index = self._positions.pop(tile, None)
+        if index is None:
+            return
+        #move the last tile into the gap
+        lastTile = self._tiles.pop()
+        if lastTile is not tile:
+            self._tiles[index] = lastTile
+            self._positions[lastTile] = index
+
+    def randomTile(self, rng=random):
+        """
+        Returns a random tile from this pool or None if the pool is empty.
+        Arguments
+            rng - random number generator used to pick the tile
+        """
+        if len(self._tiles) == 0:
+            return None
+        return rng.choice(self._tiles)
+
+
+class Tile(object):
+    """
+    represents a Tile on the map
+    """
+    #A map holds thousands of tiles, slots keep them small. The state of
+    #the tile is stored in the matrices of the map.
+    __slots__ = ('_map', '_x', '_y', '_actors')
 
     @property
     def x(self):
@@ -574,8 +1244,6 @@ class Tile():
         """
         return self._x
 
-    _y = 0
-
     @property
     def y(self):
         """
@@ -583,8 +1251,6 @@ class Tile():
         """
         return self._y
 
-    _map = None
-
     @property
     def map(self):
         """
@@ -592,51 +1258,51 @@ class Tile():
         """
         return self._map
 
-    _explored = False
-
     @property
     def explored(self):
         """
         Returns a boolean indicating if this tile has been explored.
         """
-        return self._explored
+        return self._map.exploredMatrix[self._x][self._y] == 1
 
     @explored.setter
     def explored(self, isExplored):
-        self._explored = isExplored
-
-    _blocked = False
+        if isExplored != self.explored:
+            self._map.exploredMatrix[self._x][self._y] = isExplored
+            self._map.tileExploredChanged(self)
 
     @property
     def blocked(self):
         """
         Returns a boolean indicating if this tile is blocked.
         """
-        return self._blocked
+        return self._map.blockedMatrix[self._x][self._y] == 1
 
     @blocked.setter
     def blocked(self, isBlocked):
-        self._blocked = isBlocked
+        if isBlocked != self.blocked:
+            self._map.blockedMatrix[self._x][self._y] = isBlocked
+            self._map.tileOccupancyChanged(self)
+            self._map.tileTerrainChanged(self)
         #Blocked tiles also block line of sight
         # NOTE: not neccesarily, this is how windows and fences are made :)
         # Lol, good point, and we need shrubberies! :)
         if isBlocked is True:
-            self._block_sight = True
-
-    _block_sight = False
+            self.blockSight = True
 
     @property
     def blockSight(self):
         """
         Returns a boolean indicating if this tile blocks line of sight.
         """
-        return self._block_sight
+        return self._map.blockSightMatrix[self._x][self._y] == 1
 
     @blockSight.setter
     def blockSight(self, blocksLineOfSight):
-        self._blockSight = blocksLineOfSight
-
-    _in_view = True
+        if blocksLineOfSight != self.blockSight:
+            self._map.blockSightMatrix[self._x][self._y] = blocksLineOfSight
+            self._map.tileSightChanged(self)
+            self._map.tileTerrainChanged(self)
 
     @property
     def inView(self):
@@ -645,15 +1311,21 @@ class Tile():
         This is set by the game engine during each turn.
         """
 
-        return self._in_view
+        return self._map.inViewMatrix[self._x][self._y] == 1
 
-    _actors = []
+    @inView.setter
+    def inView(self, isInView):
+        self._map.inViewMatrix[self._x][self._y] = isInView
 
     @property
     def actors(self):
         """
         Returns actors on this tile.
         """
+        #most tiles never hold an actor, their list is only created when
+        #the first actor arrives
+        if self._actors is None:
+            return ()
         return self._actors
 
     @property
@@ -661,20 +1333,18 @@ class Tile():
         """
         Returns a boolean indicating if this tile is empty
         """
-        if len(self.actors) == 0:
-            return True
-        return False
+        return self._actors is None
 
     def __init__(self, map, x, y):
         """
-        Constructor to create a new tile, all tiles are created empty
-        (unexplored, unblocked and not blocking line of sight)
+        Constructor to create a new tile, all tiles are created empty.
+        The other properties of the tile are stored on the map.
         Arguments
             map - Map object of which this tile is a part
             x - x coordinate of the tile on the map
             y - y coordinate of the tile on the map
         """
-        self._actors = []
+        self._actors = None
         self._map = map
         self._x = x
         self._y = y
@@ -690,10 +1360,17 @@ class Tile():
         """
         This function adds and actor to this tile
         """
-        self._actors.append(myActor)
+        if self._actors is None:
+            self._actors = [myActor]
+            self._map.tileOccupancyChanged(self)
+        else:
+            self._actors.append(myActor)
 
     def removeActor(self, myActor):
         """
-        This function adds and actor to this tile
+        This function removes an actor from this tile
         """
         self._actors.remove(myActor)
+        if len(self._actors) == 0:
+            self._actors = None
+            self._map.tileOccupancyChanged(self)
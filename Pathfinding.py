@@ -0,0 +1,125 @@
+#!/usr/bin/python
+
+#Module with path finding logic that works on the matrices of a map
+
+import heapq
+
+#relative positions of the neighbours of a tile
+ORTHOGONAL_STEPS = ((1, 0), (-1, 0), (0, 1), (0, -1))
+DIAGONAL_STEPS = ((1, 1), (1, -1), (-1, 1), (-1, -1))
+
+
+def heuristic(x1, y1, x2, y2, diagonalCost):
+    """
+    Estimates the cost of the cheapest path between two points.
+    This is the octile distance when diagonal moves are allowed and the
+    manhattan distance otherwise. A diagonal step never costs more than two
+    orthogonal steps, so the estimate never exceeds the real cost.
+    """
+    dx = abs(x1 - x2)
+    dy = abs(y1 - y2)
+    if diagonalCost is None:
+        return dx + dy
+    return dx + dy + (min(diagonalCost, 2) - 2) * min(dx, dy)
+
+
+def findPath(blockedMatrix, x1, y1, x2, y2, diagonalCost=1):
+    """
+    Finds the cheapest path between two points using the A* algorithm.
+    Arguments
+        blockedMatrix - matrix created with make_matrix() or a map matrix,
+                        values of 1 or True are impassable.
+        x1, y1 - start position
+        x2, y2 - goal position, it may be blocked itself
+        diagonalCost - cost of a diagonal step, orthogonal steps cost 1.
+                       Use None to disallow diagonal steps.
+    Returns
+        list of (x, y) positions leading from the start (excluded) to the
+        goal (included) or None if the goal can't be reached.
+    """
+    width = len(blockedMatrix)
+    height = len(blockedMatrix[0])
+    steps = [(dx, dy, 1) for dx, dy in ORTHOGONAL_STEPS]
+    if diagonalCost is not None:
+        steps += [(dx, dy, diagonalCost) for dx, dy in DIAGONAL_STEPS]
+
+    start = (x1, y1)
+    goal = (x2, y2)
+    #the heap contains (estimated total cost, cost so far, position)
+    openHeap = [(heuristic(x1, y1, x2, y2, diagonalCost), 0, start)]
+    cameFrom = {start: None}
+    costSoFar = {start: 0}
+    while openHeap:
+        estimate, cost, current = heapq.heappop(openHeap)
+        if current == goal:
+            break
+        #skip entries that were improved after being pushed
+        if cost > costSoFar[current]:
+            continue
+        cx, cy = current
+        for dx, dy, stepCost in steps:
+            nx = cx + dx
+            ny = cy + dy
+            if nx < 0 or ny < 0 or nx >= width or ny >= height:
+                continue
+            neighbour = (nx, ny)
+            if blockedMatrix[nx][ny] and neighbour != goal:
+                continue
+            newCost = cost + stepCost
+            if neighbour not in costSoFar or newCost < costSoFar[neighbour]:
+                costSoFar[neighbour] = newCost
+                cameFrom[neighbour] = current
+                heapq.heappush(openHeap, (newCost +
+                        heuristic(nx, ny, x2, y2, diagonalCost),
+                        newCost, neighbour))
+    else:
+        #ran out of positions to explore
+        return None
+
+    #walk back from the goal to the start
+    path = []
+    position = goal
+    while position != start:
+        path.append(position)
+        position = cameFrom[position]
+    path.reverse()
+    return path
+
+
+def distanceMap(blockedMatrix, x, y, maxDistance, diagonalSteps=True):
+    """
+    Calculates the number of steps from every reachable position towards
+    the point (x, y) with a breadth first search, this is Dijkstra's
+    algorithm for steps of equal cost.
+    Arguments
+        blockedMatrix - matrix created with make_matrix() or a map matrix,
+                        values of 1 or True are impassable.
+        x, y - the point to which the distances are calculated
+        maxDistance - positions further away than this are not visited
+        diagonalSteps - boolean indicating if diagonal steps are allowed
+    Returns
+        dictionary of (x, y) positions to their distance in steps
+    """
+    width = len(blockedMatrix)
+    height = len(blockedMatrix[0])
+    steps = ORTHOGONAL_STEPS
+    if diagonalSteps:
+        steps = steps + DIAGONAL_STEPS
+    distances = {(x, y): 0}
+    frontier = [(x, y)]
+    for distance in range(1, maxDistance + 1):
+        nextFrontier = []
+        for cx, cy in frontier:
+            for dx, dy in steps:
+                nx = cx + dx
+                ny = cy + dy
+                if nx < 0 or ny < 0 or nx >= width or ny >= height:
+                    continue
+                if blockedMatrix[nx][ny] or (nx, ny) in distances:
+                    continue
+                distances[(nx, ny)] = distance
+                nextFrontier.append((nx, ny))
+        if len(nextFrontier) == 0:
+            break
+        frontier = nextFrontier
+    return distances
@@ -6,50 +6,130 @@
 #TODO medium: this module should be made PEP8 compliant
 import random
 import math
+import hashlib
 import CONSTANTS
+import Dice
 
 
 # rolling a hitdie
-def rollHitDie(hitdie):
+def rollHitDie(hitdie, rng=random):
     """
     this function simulates rolling hit dies and returns the resulting
     nbr of hitpoints. Hit dies are specified in the format xdy where
     x indicates the number of times that a die (d) with y sides is
     thrown. For example 2d6 means rolling 2 six sided dices.
+    A modifier like in 2d6+3 is allowed as well, see Dice.getDice().
     Arguments
         hitdie - a string in hitdie format
+        rng - random number generator, the random module or a random.Random
     Returns
         integer number of hitpoints
     """
-    #interpret the hitdie string
-    d_index = hitdie.lower().index('d')
-    nbr_of_rolls = int(hitdie[0:d_index])
-    dice_size = int(hitdie[d_index + 1:])
-    #roll the dice
-    role_count = 0
-    hitpoints = 0
-    while role_count <= nbr_of_rolls:
-        role_count += 1
-        hitpoints += random.randrange(1, dice_size)
-    return hitpoints
+    return Dice.getDice(hitdie).roll(rng)
 
-def randomChoiceIndex(chances):
+def randomChoiceIndex(chances, rng=random):
     """
     Returns the index of a random choice based on a list of chances.
+    The optional rng argument is the random number generator to use.
+    To choose repeatedly from the same chances, create a WeightedSampler
+    once and use that instead.
     """
-    #the dice will land on some number between 1 and the sum of the chances
-    dice = random.randrange(1, sum(chances))
+    return WeightedSampler(chances).sample(rng)
 
-    #go through all chances, keeping the sum so far
-    running_sum = 0
-    choice = 0
-    for w in chances:
-        running_sum += w
 
-        #see if the dice landed in the part that corresponds to this choice
-        if dice <= running_sum:
-            return choice
-        choice += 1
+class WeightedSampler(object):
+    """
+    Chooses random indices from a list of weights in constant time, using
+    Vose's alias method. Creating the sampler takes linear time, it is meant
+    to be reused for the same weights.
+    """
+
+    def __init__(self, weights):
+        """
+        Constructor to create a new sampler.
+        Arguments
+            weights - list of non-negative whole numbers, the chance of an
+                      index is its weight divided by the sum of the weights
+        """
+        count = len(weights)
+        total = sum(weights)
+        if count == 0 or total <= 0 or min(weights) < 0 \
+                or any(weight != int(weight) for weight in weights):
+            raise GameError("Can't sample from weights " + str(weights))
+        #whole numbers like 2.0 are allowed, the columns below are indexed
+        #with integers
+        weights = [int(weight) for weight in weights]
+        total = sum(weights)
+        #Every index gets a column of height total. The column holds the
+        #index itself up to its threshold and its alias above that.
+        scaled = [weight * count for weight in weights]
+        threshold = [total] * count
+        alias = list(range(count))
+        small = [i for i in range(count) if scaled[i] < total]
+        large = [i for i in range(count) if scaled[i] >= total]
+        while small and large:
+            less = small.pop()
+            more = large.pop()
+            threshold[less] = scaled[less]
+            alias[less] = more
+            #the larger weight fills up the rest of the column
+            scaled[more] -= total - scaled[less]
+            if scaled[more] < total:
+                small.append(more)
+            else:
+                large.append(more)
+        self._threshold = threshold
+        self._alias = alias
+        self._total = total
+        self._size = count * total
+
+    def sample(self, rng=random):
+        """
+        Returns a random index.
+        Arguments
+            rng - random number generator, the random module or a random.Random
+        """
+        column, height = divmod(int(rng.random() * self._size), self._total)
+        if height < self._threshold[column]:
+            return column
+        return self._alias[column]
+
+    def sampleMany(self, k, rng=random):
+        """
+        Returns a list of k random indices, this draws the same random
+        numbers as k calls of sample().
+        Arguments
+            k - number of indices
+            rng - random number generator, the random module or a random.Random
+        """
+        draw = rng.random
+        size = self._size
+        total = self._total
+        threshold = self._threshold
+        alias = self._alias
+        result = []
+        for i in range(k):
+            column, height = divmod(int(draw() * size), total)
+            if height < threshold[column]:
+                result.append(column)
+            else:
+                result.append(alias[column])
+        return result
+
+def deriveSeed(seed, *keys):
+    """
+    Derives a new seed from a master seed and some keys that name what the
+    seed is used for, for example deriveSeed(seed, 'dungeon', 3).
+    The result only depends on the arguments, not on the state of any
+    random number generator, and is the same on every platform.
+    Arguments
+        seed - integer master seed
+        keys - strings or integers identifying the use of the seed
+    Returns
+        32 bit integer seed
+    """
+    text = ':'.join(str(key) for key in (seed,) + keys)
+    return int(hashlib.sha1(text.encode('utf-8')).hexdigest()[:8], 16)
 
 # This property is used by the message function to send game messages
 # to the application where they can be shown.
@@ -178,6 +258,25 @@ def get_line_segments(x1, y1, x2, y2):
     return points
 
 
+# Cache of relative line segments, see get_line_offsets()
+_lineOffsets = {}
+
+
+def get_line_offsets(dx, dy):
+    """
+    Returns the line segments between (0, 0) and (dx, dy) as a tuple.
+    The lines of get_line_segments() only depend on the difference between
+    their end points, so adding (x1, y1) to these offsets gives the line
+    from (x1, y1) to (x1 + dx, y1 + dy). Every offset is calculated once.
+    """
+    key = (dx, dy)
+    offsets = _lineOffsets.get(key)
+    if offsets is None:
+        offsets = tuple(get_line_segments(0, 0, dx, dy))
+        _lineOffsets[key] = offsets
+    return offsets
+
+
 def line_of_sight(matrix, x1, y1, x2, y2):
     """
     Returns True if there is line of sight between two points.
@@ -185,13 +284,16 @@ def line_of_sight(matrix, x1, y1, x2, y2):
     This is a matrix created with make_matrix().
     matrix values of 0 or False are not solid, 1 or True are solid.
 
+    The line is walked from the start and the walk stops at the first
+    solid position.
     """
-
-    segs = get_line_segments(x1, y1, x2, y2)
-    hits = [matrix[x][y] for x, y in segs]
-    amt = hits.count(True)
-    # allow 1 case: if the final destination position is blocking
-    return amt == 0 or (amt == 1 and matrix[x2][y2])
+    for dx, dy in get_line_offsets(x2 - x1, y2 - y1):
+        x = x1 + dx
+        y = y1 + dy
+        if matrix[x][y]:
+            # allow 1 case: if the final destination position is blocking
+            return x == x2 and y == y2
+    return True
 
 
 class GameError(Exception):